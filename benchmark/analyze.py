@@ -0,0 +1,230 @@
+from argparse import ArgumentParser
+import csv
+from dataclasses import dataclass
+from pathlib import Path
+import re
+
+VBS = 'VBS'
+
+
+@dataclass(frozen=True, kw_only=True)
+class Run:
+    # ソルバ名 (SATLIB) または制約の組み合わせ (ナンバーリンク)
+    competitor: str
+    instance: str
+    family: str
+    elapsed: float
+    solved: bool
+
+
+def family_of(cnf: str) -> str:
+    # uf20-01.cnf -> uf20, bmc-ibm-1.cnf -> bmc-ibm
+    stem = Path(cnf).stem
+    m = re.match(r'^(.*?)[-_]?\d+$', stem)
+    return m.group(1) if m and m.group(1) else stem
+
+
+def load_runs(csv_path: str) -> list[Run]:
+    # benchmark/bench.pyとnumberlink/bench.pyのどちらのCSVも読める
+    runs: list[Run] = []
+    with open(csv_path) as f:
+        for row in csv.DictReader(f):
+            if 'solver' in row:
+                # solver,cnf,elapsed,result[,verified]
+                solved = row['result'] in ('SAT', 'UNSAT') \
+                    and row.get('verified') != 'INVALID'
+                runs.append(Run(
+                    competitor=row['solver'],
+                    instance=row['cnf'],
+                    family=family_of(row['cnf']),
+                    elapsed=float(row['elapsed']),
+                    solved=solved,
+                ))
+            else:
+                # label,[problem,]elapsed,...,verified,rows,cols,num_lines
+                instance = row.get('problem') \
+                    or f'{row["rows"]}x{row["cols"]}-{row["num_lines"]}'
+                runs.append(Run(
+                    competitor=row['label'],
+                    instance=instance,
+                    family=f'{row["rows"]}x{row["cols"]}',
+                    elapsed=float(row['elapsed']),
+                    solved=row.get('verified', 'True') == 'True',
+                ))
+    return runs
+
+
+def apply_timeout(runs: list[Run], timeout: float) -> list[Run]:
+    # 制限時間を超えたものは解けなかったことにする
+    return [Run(
+        competitor=r.competitor,
+        instance=r.instance,
+        family=r.family,
+        elapsed=r.elapsed,
+        solved=r.solved and r.elapsed <= timeout,
+    ) for r in runs]
+
+
+def virtual_best(runs: list[Run]) -> list[Run]:
+    # 各インスタンスについて最も速く解けた結果を集めた仮想ソルバ
+    best: dict[str, Run] = {}
+    for r in runs:
+        cur = best.get(r.instance)
+        if cur is None \
+                or (r.solved and not cur.solved) \
+                or (r.solved == cur.solved and r.elapsed < cur.elapsed):
+            best[r.instance] = r
+    return [Run(
+        competitor=VBS,
+        instance=r.instance,
+        family=r.family,
+        elapsed=r.elapsed,
+        solved=r.solved,
+    ) for r in best.values()]
+
+
+def cactus(runs: list[Run]) -> list[float]:
+    # 解けたインスタンスの時間を昇順に並べたもの
+    # i番目の値は「i+1問解くのに必要な1問あたりの制限時間」
+    return sorted(r.elapsed for r in runs if r.solved)
+
+
+def par2(runs: list[Run], timeout: float) -> float:
+    # 解けなかったものは制限時間の2倍として平均する
+    if not runs:
+        return 0.0
+    total = sum(r.elapsed if r.solved else 2 * timeout for r in runs)
+    return total / len(runs)
+
+
+@dataclass(frozen=True, kw_only=True)
+class Summary:
+    competitor: str
+    family: str
+    instances: int
+    solved: int
+    par2: float
+
+
+def summarize(runs: list[Run], timeout: float) -> list[Summary]:
+    # 競技者ごと、および競技者とファミリーの組ごとの集計
+    groups: dict[tuple[str, str], list[Run]] = {}
+    for r in runs:
+        groups.setdefault((r.competitor, '*'), []).append(r)
+        groups.setdefault((r.competitor, r.family), []).append(r)
+    return [Summary(
+        competitor=competitor,
+        family=family,
+        instances=len(rs),
+        solved=sum(r.solved for r in rs),
+        par2=par2(rs, timeout),
+    ) for (competitor, family), rs in groups.items()]
+
+
+def show_summary(summaries: list[Summary]):
+    width = max(len(s.competitor) for s in summaries)
+    family_width = max(len(s.family) for s in summaries)
+    print(f'{"competitor":<{width}}  {"family":<{family_width}}  '
+          f'{"solved":>11}  {"PAR-2":>10}')
+    for s in sorted(summaries,
+                    key=lambda s: (s.family != '*', s.family, s.par2)):
+        solved = f'{s.solved}/{s.instances}'
+        print(f'{s.competitor:<{width}}  {s.family:<{family_width}}  '
+              f'{solved:>11}  {s.par2:>10.4g}')
+
+
+def write_summary(summaries: list[Summary], csv_path: str):
+    with open(csv_path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['competitor', 'family', 'instances', 'solved',
+                         'par2'])
+        for s in summaries:
+            writer.writerow([s.competitor, s.family, s.instances, s.solved,
+                             s.par2])
+
+
+def plot_cactus(
+        curves: dict[str, list[float]],
+        timeout: float,
+        output: str):
+    # matplotlibがなければ図は作らない (集計だけなら不要なため)
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('matplotlib is not installed; skipping the cactus plot')
+        return
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for competitor, times in curves.items():
+        style = '--' if competitor == VBS else '-'
+        ax.step(range(1, len(times) + 1), times, where='post',
+                linestyle=style, marker='.', markersize=3, label=competitor)
+    ax.set_xlabel('Number of Solved Instances')
+    ax.set_ylabel('Time (s)')
+    ax.set_ylim(top=timeout)
+    ax.set_yscale('log')
+    ax.grid(True, which='both', alpha=0.3)
+    ax.legend(loc='upper left')
+    fig.tight_layout()
+    fig.savefig(output)
+    print(f'Saved {output}')
+
+
+def main():
+    parser = ArgumentParser(description='benchmark result analysis tool')
+    parser.add_argument(
+        'csvfiles',
+        nargs='+',
+        help='result CSV files '
+        '(from benchmark/bench.py or numberlink/bench.py)',
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        help='count runs slower than this as unsolved (default: slowest run)',
+    )
+    parser.add_argument(
+        '-o', '--output',
+        default='cactus.png',
+        help='cactus plot file (.png or .svg)',
+    )
+    parser.add_argument(
+        '--summary',
+        help='write the summary table to this CSV file',
+    )
+    parser.add_argument(
+        '--no-vbs',
+        action='store_true',
+        help='do not add the virtual best solver',
+    )
+    opts = parser.parse_args()
+
+    runs: list[Run] = []
+    for csv_path in opts.csvfiles:
+        runs.extend(load_runs(csv_path))
+    if not runs:
+        parser.error('no runs found')
+
+    timeout = opts.timeout
+    if timeout is None:
+        timeout = max(r.elapsed for r in runs)
+    runs = apply_timeout(runs, timeout)
+    if not opts.no_vbs:
+        runs.extend(virtual_best(runs))
+
+    summaries = summarize(runs, timeout)
+    show_summary(summaries)
+    if opts.summary is not None:
+        write_summary(summaries, opts.summary)
+
+    by_competitor: dict[str, list[Run]] = {}
+    for r in runs:
+        by_competitor.setdefault(r.competitor, []).append(r)
+    curves = {c: cactus(rs) for c, rs in by_competitor.items()}
+    plot_cactus(curves, timeout, opts.output)
+
+
+if __name__ == '__main__':
+    main()
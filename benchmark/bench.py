@@ -6,10 +6,7 @@ from typing import cast
 from pysat.formula import CNF
 from pysat.solvers import Solver
 
-parser = ArgumentParser(description='SAT solver benchmarking tool')
-parser.add_argument('cnfdir', type=str, help='directory of CNF files')
-parser.add_argument('csvfile', type=str, help='output CSV file')
-args = parser.parse_args()
+from schedule import longest_first, predict, report_makespan, run_in_order
 
 solver_names = [
     'cadical153',
@@ -17,31 +14,95 @@ solver_names = [
     'minisat22',
 ]
 
-cnfs: dict[str, CNF] = {}
-files = sorted(glob(f'{args.cnfdir}/*.cnf'))
+Row = tuple[str, str, float, str, str]
 
-for cnfpath in files:
+
+def cnf_size(cnfpath: str) -> float:
+    # ヘッダ(p cnf 変数の数 節の数)だけを読み、変数の数 x 節の数を大きさとする
+    with open(cnfpath) as f:
+        for line in f:
+            if line.startswith('p'):
+                parts = line.split()
+                return int(parts[2]) * int(parts[3])
+    return 0.0
+
+
+def load_history(csv_path: str) -> dict[tuple[str, str], float]:
+    # 前回の結果CSVから、(ソルバ, CNF)ごとの時間を読む
+    if not Path(csv_path).exists():
+        return {}
+    with open(csv_path) as f:
+        return {(row['solver'], row['cnf']): float(row['elapsed'])
+                for row in csv.DictReader(f)}
+
+
+def solve(solver_name: str, cnfpath: str) -> Row:
+    # ワーカーで読み込むので、親プロセスに全てのCNFを載せておく必要はない
     p = Path(cnfpath)
-    print(f'Loading {p.name} ...')
-    cnfs[p.name] = CNF(from_file=cnfpath, comment_lead=['c', '%', '0'])
-
-results = []
-
-for solver_name in solver_names:
-    for cnfpath in files:
-        p = Path(cnfpath)
-        print(f'Solving {p.name} with {solver_name} ...')
-        solver = Solver(name=solver_name,
-                        bootstrap_with=cnfs[p.name].clauses,
-                        use_timer=True)
-        is_sat = cast(bool, solver.solve())
-        elapsed = cast(float, solver.time())
-        sat = 'SAT' if is_sat else 'UNSAT'
-        print(f'{solver_name}, {p.name}, {elapsed:.3f}, {sat}')
-        results.append((solver_name, p.name, elapsed, sat))
-
-with open(args.csvfile, 'w') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['solver', 'cnf', 'elapsed', 'result'])
-    for row in results:
-        writer.writerow(row)
+    cnf = CNF(from_file=cnfpath, comment_lead=['c', '%', '0'])
+    solver = Solver(name=solver_name,
+                    bootstrap_with=cnf.clauses,
+                    use_timer=True)
+    is_sat = cast(bool, solver.solve())
+    elapsed = cast(float, solver.time())
+    sat = 'SAT' if is_sat else 'UNSAT'
+    # 計測の外で、モデルが全ての節を充足しているか線形時間で確かめる
+    verified = ''
+    if is_sat:
+        model = set(cast(list[int], solver.get_model()))
+        ok = all(any(l in model for l in c) for c in cnf.clauses)
+        verified = 'VERIFIED' if ok else 'INVALID'
+    solver.delete()
+    return (solver_name, p.name, elapsed, sat, verified)
+
+
+def main():
+    parser = ArgumentParser(description='SAT solver benchmarking tool')
+    parser.add_argument('cnfdir', type=str, help='directory of CNF files')
+    parser.add_argument('csvfile', type=str, help='output CSV file')
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='number of instances solved in parallel',
+    )
+    parser.add_argument(
+        '--history',
+        help='results CSV used to predict run times '
+        '(default: csvfile, if it already exists)',
+    )
+    args = parser.parse_args()
+
+    files = sorted(glob(f'{args.cnfdir}/*.cnf'))
+    paths = {Path(f).name: f for f in files}
+
+    # 時間がかかりそうなものから先に始め、最後に長いものが残らないようにする
+    sizes = {(solver_name, name): cnf_size(path)
+             for solver_name in solver_names
+             for name, path in paths.items()}
+    history = load_history(args.history or args.csvfile)
+    predictions, calibrated = predict(sizes, history)
+    order = longest_first(predictions)
+
+    results: dict[tuple[str, str], Row] = {}
+
+    def done(job: tuple[str, str], row: Row):
+        # jobは(ソルバ, CNFのパス)
+        solver_name, name, elapsed, sat, verified = row
+        print(f'{solver_name}, {name}, {elapsed:.3f}, {sat}, {verified}')
+        results[(solver_name, name)] = row
+
+    actual = run_in_order(
+        solve, [(s, paths[name]) for s, name in order], args.jobs, done)
+    report_makespan(order, predictions, calibrated, args.jobs, actual)
+
+    with open(args.csvfile, 'w') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['solver', 'cnf', 'elapsed', 'result', 'verified'])
+        # 実行順によらず、ソルバとファイル名の順に書く
+        for key in sizes:
+            writer.writerow(results[key])
+
+
+if __name__ == '__main__':
+    main()
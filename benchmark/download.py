@@ -1,7 +1,17 @@
 from argparse import ArgumentParser
-import io
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+from pathlib import Path
 import tarfile
+import tempfile
+from typing import BinaryIO
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import requests
 
 urls = [
     'https://www.cs.ubc.ca/~hoos/SATLIB/Benchmarks/SAT/RND3SAT/uf20-91.tar.gz',
@@ -18,13 +28,191 @@ urls = [
     'https://www.cs.ubc.ca/~hoos/SATLIB/Benchmarks/SAT/BMC/bmc.tar.gz'
 ]
 
-parser = ArgumentParser(description='SATLIB problem downloader')
-parser.add_argument('outdir', type=str, help='output directory')
-opts = parser.parse_args()
+CHUNK_SIZE = 1 << 16
+
+
+@dataclass(frozen=True, kw_only=True)
+class Entry:
+    # manifest.jsonの1件 (アーカイブ1つ分)
+    url: str
+    sha256: str
+    size: int
+    files: tuple[str, ...]
+
+
+def load_manifest(cache_dir: Path) -> dict[str, Entry]:
+    path = cache_dir / 'manifest.json'
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    return {url: Entry(url=url, sha256=e['sha256'], size=e['size'],
+                       files=tuple(e['files']))
+            for url, e in data.items()}
+
+
+def save_manifest(cache_dir: Path, manifest: dict[str, Entry]):
+    data = {url: {'sha256': e.sha256, 'size': e.size, 'files': list(e.files)}
+            for url, e in sorted(manifest.items())}
+    # 書きかけのmanifestが残らないよう、一時ファイルから置き換える
+    tmp = cache_dir / 'manifest.json.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, cache_dir / 'manifest.json')
+
+
+def resolve(url: str, mirror: str | None) -> str:
+    # ミラーが指定されていれば、アーカイブ名だけを引き継いでミラーから取る
+    if mirror is None:
+        return url
+    name = url.rsplit('/', 1)[1]
+    return mirror.rstrip('/') + '/' + name
+
+
+def open_source(location: str) -> tuple[BinaryIO, requests.Response | None]:
+    # ローカルのパスとfile:// URLはファイルとして、それ以外はHTTPで開く
+    parsed = urlparse(location)
+    if parsed.scheme == 'file':
+        return open(url2pathname(parsed.path), 'rb'), None
+    if parsed.scheme in ('http', 'https'):
+        r = requests.get(location, allow_redirects=True, stream=True)
+        r.raise_for_status()
+        r.raw.decode_content = True
+        return r.raw, r
+    return open(location, 'rb'), None
+
+
+def sha256_of(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def copy_hashing(source: BinaryIO, sink: BinaryIO) -> tuple[str, int]:
+    # 読んだバイト列をハッシュしつつ書き出し、ハッシュと大きさを返す
+    sha256 = hashlib.sha256()
+    size = 0
+    while chunk := source.read(CHUNK_SIZE):
+        sha256.update(chunk)
+        sink.write(chunk)
+        size += len(chunk)
+    return sha256.hexdigest(), size
+
+
+def extract(path: Path, outdir: str) -> tuple[str, ...]:
+    # アーカイブ全体をメモリに載せず、ストリームのまま展開する
+    files: list[str] = []
+    with tarfile.open(path, mode='r|*') as tar:
+        for member in tar:
+            tar.extract(member, outdir, filter='data')
+            if member.isfile():
+                files.append(member.name)
+    return tuple(files)
+
+
+def fetch(url: str, outdir: str, cache_dir: Path, mirror: str | None,
+          cached: Entry | None) -> Entry:
+    # キャッシュにあり、チェックサムが一致すればそこから展開する
+    if cached is not None:
+        path = cache_dir / cached.sha256
+        if path.exists() and sha256_of(path) == cached.sha256:
+            print(f'Extracting {url} from cache...')
+            return Entry(url=url, sha256=cached.sha256, size=cached.size,
+                         files=extract(path, outdir))
+
+    location = resolve(url, mirror)
+    print(f'Downloading {location}...')
+    source, response = open_source(location)
+    # 内容のハッシュが分かるまでは一時ファイルに書き、確かめてから名前を付ける
+    # 展開するのは確かめ終えたキャッシュのファイルだけにする
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as sink:
+            sha256, size = copy_hashing(source, sink)
+        if cached is not None and cached.sha256 != sha256:
+            raise RuntimeError(
+                f'checksum mismatch for {url}: '
+                f'expected {cached.sha256}, got {sha256}')
+        os.replace(tmp, cache_dir / sha256)
+    finally:
+        source.close()
+        if response is not None:
+            response.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    print(f'Extracting {url}...')
+    files = extract(cache_dir / sha256, outdir)
+    return Entry(url=url, sha256=sha256, size=size, files=files)
+
+
+def is_extracted(entry: Entry, outdir: str) -> bool:
+    return all((Path(outdir) / name).exists() for name in entry.files)
+
+
+def main():
+    parser = ArgumentParser(description='SATLIB problem downloader')
+    parser.add_argument('outdir', type=str, help='output directory')
+    parser.add_argument(
+        '--cache',
+        default='cache',
+        help='directory for downloaded archives and manifest.json',
+    )
+    parser.add_argument(
+        '--mirror',
+        help='local directory or file:// / http(s):// URL holding the '
+        'same archive names',
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=4,
+        help='number of concurrent downloads',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='extract again even if the files are already present',
+    )
+    opts = parser.parse_args()
+
+    cache_dir = Path(opts.cache)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(cache_dir)
+
+    todo: list[str] = []
+    for url in urls:
+        entry = manifest.get(url)
+        if entry is not None and not opts.force \
+                and is_extracted(entry, opts.outdir):
+            print(f'Skipping {url} (already extracted)')
+            continue
+        todo.append(url)
+
+    failed = False
+    with ThreadPoolExecutor(max_workers=opts.jobs) as executor:
+        futures = {
+            executor.submit(fetch, url, opts.outdir, cache_dir, opts.mirror,
+                            manifest.get(url)): url
+            for url in todo}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                entry = future.result()
+            except Exception as err:
+                print(f'Failed {url}: {err}')
+                failed = True
+                continue
+            manifest[url] = entry
+            # 途中で止まっても済んだ分は次回に使えるよう、都度保存する
+            save_manifest(cache_dir, manifest)
+            print(f'Done {url} '
+                  f'({len(entry.files)} files, sha256 {entry.sha256[:12]})')
+
+    if failed:
+        raise SystemExit(1)
+
 
-for url in urls:
-    print(f'Downloading {url}...')
-    r = requests.get(url, allow_redirects=True)
-    r.raise_for_status()
-    with tarfile.open(fileobj=io.BytesIO(r.content), mode='r:gz') as tar:
-        tar.extractall(opts.outdir)
+if __name__ == '__main__':
+    main()
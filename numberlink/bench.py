@@ -1,7 +1,23 @@
+from argparse import ArgumentParser
+import csv
 from dataclasses import dataclass
+from statistics import median
 import subprocess
 from glob import glob
+import sys
 from sys import executable
+from time import perf_counter
+
+from problem import load_problem
+from schedule import longest_first, predict, report_makespan, run_in_order
+from shard import encode_sharded
+from stats import bootstrap_ci, bootstrap_ratio_ci
+
+# これより小さな時間の差はタイマーの分解能以下とみなす
+RESOLUTION = 1e-3
+# 前回と比べるのに必要な、片側あたりの計測回数
+# 2, 3回の標本を復元抽出しても取り得る中央値が少なく、信頼区間が狭く出すぎる
+MIN_SAMPLES = 10
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -11,73 +27,345 @@ class Problem:
     num_lines: int
 
 
+@dataclass(frozen=True, kw_only=True)
+class Measurement:
+    elapsed: float
+    num_clauses: int
+    conflicts: int
+    verified: bool
+
+
 @dataclass(frozen=True, kw_only=True)
 class Result:
     label: str
+    path: str
+    # 実行時間の中央値とそのブートストラップ信頼区間
     elapsed: float
+    ci_low: float
+    ci_high: float
+    samples: tuple[float, ...]
+    num_clauses: int
+    conflicts: float
+    verified: bool
     problem: Problem
+    # 捨てる実行も含めた計測全体の経過時間 (次回の実行順の見積もりに使う)
+    wall: float
 
 
 def parse_problem(path: str) -> Problem:
-    with open(path, 'r') as f:
-        lines = f.readlines()
-    # SIZE 10X10
-    rows, cols = map(int, lines[0].split(' ')[1].split('X'))
-    # LINE_NUM 7
-    num_lines = int(lines[1].split(' ')[1])
-    return Problem(rows=rows, cols=cols, num_lines=num_lines)
+    nl = load_problem(path)
+    return Problem(rows=nl.rows, cols=nl.cols, num_lines=nl.num_lines)
+
+
+def run_once(cmd: str) -> Measurement:
+    process = subprocess.run(cmd, shell=True, capture_output=True)
+    # output should be time elapsed, problem size, statistics
+    # and verification
+    output = process.stdout.decode('utf-8').splitlines()
+    stats = dict(item.split('=') for item in
+                 output[2].removeprefix('Statistics: ').split(', '))
+    return Measurement(
+        elapsed=float(output[0]),
+        num_clauses=int(output[1].split()[1]),
+        conflicts=int(stats['conflicts']),
+        verified=output[3] == 'VERIFIED',
+    )
+
+
+def measure(label: str, path: str, args: str, opts) -> Result:
+    started = perf_counter()
+    cmd = f'{executable} numberlink/main.py -t {path} {args} ' \
+        '--show-size --show-stats --verify'
+
+    # 捨てる実行 (ファイルキャッシュやCPUクロックを安定させる)
+    for _ in range(opts.warmup):
+        run_once(cmd)
+
+    # 信頼区間が十分狭くなるまで繰り返す
+    measurements: list[Measurement] = []
+    while True:
+        m = run_once(cmd)
+        measurements.append(m)
+        print(f'{label}:{len(measurements)-1} {path} {m.elapsed} '
+              f'{m.num_clauses} {m.conflicts} '
+              f'{"VERIFIED" if m.verified else "INVALID"}')
+        if len(measurements) < opts.min_repeats:
+            continue
+        samples = [m.elapsed for m in measurements]
+        lo, hi = bootstrap_ci(samples)
+        half_width = (hi - lo) / 2
+        if half_width <= opts.target_ci * median(samples) \
+                or half_width <= RESOLUTION \
+                or len(measurements) >= opts.max_repeats:
+            break
+
+    return Result(
+        label=label,
+        path=path,
+        elapsed=median(samples),
+        ci_low=lo,
+        ci_high=hi,
+        samples=tuple(samples),
+        num_clauses=measurements[0].num_clauses,
+        conflicts=sum(m.conflicts for m in measurements) / len(measurements),
+        verified=all(m.verified for m in measurements),
+        problem=parse_problem(path),
+        wall=perf_counter() - started,
+    )
+
+
+def load_history(csv_path: str, warmup: int) -> dict[tuple[str, str], float]:
+    # 前回の結果CSVから、(設定, 問題)ごとの計測全体にかかった時間を読む
+    # wallの列がない古いCSVでは、中央値 x 実行回数 (捨てる実行も含む) とする
+    history: dict[tuple[str, str], float] = {}
+    try:
+        with open(csv_path) as f:
+            for row in csv.DictReader(f):
+                if 'problem' not in row or 'repeats' not in row:
+                    return {}
+                if row.get('wall'):
+                    wall = float(row['wall'])
+                else:
+                    runs = warmup + int(row['repeats'])
+                    wall = float(row['elapsed']) * runs
+                history[(row['label'], row['problem'])] = wall
+    except FileNotFoundError:
+        return {}
+    return history
+
+
+def compare_with_baseline(
+        results: list[Result],
+        baseline_csv: str,
+        threshold: float) -> list[str]:
+    # 設定と問題の組ごとに中央値の比の信頼区間を求め、
+    # 1 + threshold を超えて遅くなったことが有意なものを返す
+    baseline: dict[tuple[str, str], list[float]] = {}
+    with open(baseline_csv) as f:
+        for row in csv.DictReader(f):
+            if 'samples' not in row or 'problem' not in row:
+                print(f'{baseline_csv} has no raw samples; '
+                      'rerun the baseline with this version')
+                return []
+            samples = [float(v) for v in row['samples'].split(';')]
+            baseline[(row['label'], row['problem'])] = samples
+
+    slowdowns: list[str] = []
+    for result in results:
+        base = baseline.get((result.label, result.path))
+        if base is None:
+            continue
+        if min(len(result.samples), len(base)) < MIN_SAMPLES:
+            print(f'{result.label} {result.path}: insufficient samples '
+                  f'({len(result.samples)} vs {len(base)}, '
+                  f'need {MIN_SAMPLES} each)')
+            continue
+        lo, hi = bootstrap_ratio_ci(list(result.samples), base)
+        ratio = result.elapsed / median(base) if median(base) > 0 \
+            else float('inf')
+        significant = lo > 1 and ratio > 1 + threshold \
+            and result.elapsed - median(base) > RESOLUTION
+        mark = 'SLOWER' if significant else ''
+        print(f'{result.label} {result.path}: x{ratio:.3f} '
+              f'[{lo:.3f}, {hi:.3f}] {mark}')
+        if significant:
+            slowdowns.append(f'{result.label} {result.path} x{ratio:.3f}')
+    return slowdowns
+
+
+def report_encode_scaling(
+        problems: list[str],
+        window: int,
+        jobs_list: list[int],
+        repeats: int):
+    # 節の生成だけを時間計測し、ワーカー数ごとの速度向上率を表示する
+    # (プロセスの起動と共有メモリからの連結も含む)
+    print(f'{"problem":<40} {"jobs":>4} {"encode":>10} {"speedup":>8}')
+    for path in problems:
+        nl = load_problem(path)
+        base: float | None = None
+        for jobs in jobs_list:
+            samples: list[float] = []
+            for _ in range(repeats):
+                started = perf_counter()
+                encode_sharded(nl, window, jobs)
+                samples.append(perf_counter() - started)
+            elapsed = median(samples)
+            if base is None:
+                base = elapsed
+            print(f'{path:<40} {jobs:>4} {elapsed:>9.3f}s '
+                  f'{base / elapsed:>7.2f}x')
 
 
 def main():
+    parser = ArgumentParser(description='numberlink benchmarking tool')
+    parser.add_argument(
+        '-o', '--output',
+        default='numberlink/results.csv',
+        help='output CSV file',
+    )
+    parser.add_argument(
+        '--warmup',
+        type=int,
+        default=1,
+        help='number of discarded runs before measuring',
+    )
+    parser.add_argument(
+        '--min-repeats',
+        type=int,
+        default=3,
+        help='minimum number of measured runs',
+    )
+    parser.add_argument(
+        '--max-repeats',
+        type=int,
+        default=10,
+        help='maximum number of measured runs',
+    )
+    parser.add_argument(
+        '--target-ci',
+        type=float,
+        default=0.05,
+        help='stop repeating once the 95%% CI half-width is within this '
+        'fraction of the median',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='number of measurements run in parallel (they then share the '
+        'CPU, so use at most the number of idle cores)',
+    )
+    parser.add_argument(
+        '--history',
+        help='results CSV used to predict run times '
+        '(default: --output, if it already exists)',
+    )
+    parser.add_argument(
+        '--baseline',
+        help='results CSV of a previous run to compare with '
+        f'(both runs need at least {MIN_SAMPLES} measured runs per problem; '
+        'record the baseline with --min-repeats '
+        f'{MIN_SAMPLES})',
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.05,
+        help='smallest relative slowdown to report',
+    )
+    parser.add_argument(
+        '--encode-scaling',
+        nargs='*',
+        metavar='PROBLEM',
+        help='only report encode time against worker count '
+        '(for the given problems, or all ADC2014 problems)',
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        nargs='+',
+        default=[1, 2, 4, 8],
+        help='worker counts for --encode-scaling',
+    )
+    parser.add_argument(
+        '--window',
+        type=int,
+        # main.pyの-cと同じ範囲 (0は-cなし)
+        choices=[0, 2, 3, 4],
+        default=3,
+        help='detour window for --encode-scaling, as in main.py -c '
+        '(0: no detour constraint)',
+    )
+    opts = parser.parse_args()
+    if opts.baseline is not None:
+        # 比べる側も、有意かどうかを判定できるだけの回数を計測する
+        opts.min_repeats = max(opts.min_repeats, MIN_SAMPLES)
+        opts.max_repeats = max(opts.max_repeats, opts.min_repeats)
+
     # numberlink/ADC2014_QA/Q
     problems = glob('numberlink/ADC2014_QA/Q/*.txt')
     problems.sort()
 
-    # path: details
-    details: dict[str, Problem] = {}
-    for problem in problems:
-        details[problem] = parse_problem(problem)
+    if opts.encode_scaling is not None:
+        report_encode_scaling(
+            opts.encode_scaling or problems, opts.window, opts.jobs,
+            opts.min_repeats)
+        return
 
     # label: args
     competitors = {
         "original": "",
-        "original + u-shape": "-c 2",
-        "original + u-shape-long": "-c 3",
-        "original + u-shape + u-shape-long": "-c 2 3",
+        "original + detour 2x2": "-c 2",
+        "original + detour 3x3": "-c 3",
+        "original + detour 4x4": "-c 4",
+        "original + detour 3x3 + phase": "-c 3 --phase",
     }
 
-    results: list[Result] = []
-
-    for label, args in competitors.items():
-        for problem in problems:
-            cmd = f'{executable} numberlink/main.py -t {problem} {args}'
-            elapsed_list: list[float] = []
-            for i in range(3):
-                process = subprocess.run(cmd, shell=True, capture_output=True)
-                # output should be time elapsed
-                elapsed = float(process.stdout.decode('utf-8').strip())
-                elapsed_list.append(elapsed)
-                print(f'{label}:{i} {problem} {elapsed}')
-
-            avg_elapsed = sum(elapsed_list) / len(elapsed_list)
-            result = Result(
-                label=label,
-                elapsed=avg_elapsed,
-                problem=details[problem])
-            results.append(result)
+    # 時間がかかりそうなものから先に始め、最後に長いものが残らないようにする
+    # 前回の結果がなければ、行数 x 列数 x 線の数を大きさとする
+    problem_sizes: dict[str, float] = {}
+    for problem in problems:
+        p = parse_problem(problem)
+        problem_sizes[problem] = p.rows * p.cols * p.num_lines
+    # 設定ごとに問題を並べた元の順 (CSVもこの順に書く)
+    sizes = {(label, problem): problem_sizes[problem]
+             for label in competitors for problem in problems}
+    history = load_history(opts.history or opts.output, opts.warmup)
+    predictions, calibrated = predict(sizes, history)
+    order = longest_first(predictions)
+
+    measured: dict[tuple[str, str], Result] = {}
+
+    def done(job: tuple, result: Result):
+        # jobは(設定, 問題, 引数, opts)
+        measured[(result.label, result.path)] = result
+
+    actual = run_in_order(
+        measure,
+        [(label, problem, competitors[label], opts)
+         for label, problem in order],
+        opts.workers,
+        done)
+    report_makespan(order, predictions, calibrated, opts.workers, actual)
+    results = [measured[k] for k in sizes]
 
     # export to csv
-    with open('numberlink/results.csv', 'w') as f:
-        f.write('label,elapsed,rows,cols,num_lines\n')
+    with open(opts.output, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            'label', 'problem', 'elapsed', 'ci_low', 'ci_high', 'repeats',
+            'samples', 'num_clauses', 'conflicts', 'verified',
+            'rows', 'cols', 'num_lines', 'wall'])
         for result in results:
-            data = [
+            writer.writerow([
                 result.label,
+                result.path,
                 result.elapsed,
+                result.ci_low,
+                result.ci_high,
+                len(result.samples),
+                ';'.join(map(str, result.samples)),
+                result.num_clauses,
+                result.conflicts,
+                result.verified,
                 result.problem.rows,
                 result.problem.cols,
                 result.problem.num_lines,
-            ]
-            f.write(','.join(map(str, data)) + '\n')
+                result.wall,
+            ])
+
+    invalid = [r for r in results if not r.verified]
+    for result in invalid:
+        print(f'INVALID: {result.label} {result.path}')
+
+    if opts.baseline is not None:
+        slowdowns = compare_with_baseline(
+            results, opts.baseline, opts.threshold)
+        for slowdown in slowdowns:
+            print(f'REGRESSION: {slowdown}')
+        if slowdowns:
+            sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -1,3 +1,9 @@
+from array import array
+from collections import defaultdict
+from threading import Timer
+from time import monotonic, perf_counter
+from typing import Iterable, Iterator, Sequence, cast
+
 from pysat.solvers import Solver
 
 
@@ -19,8 +25,12 @@ class Literal:
 class CnfComposer:
     def __init__(self) -> None:
         self.clauses: list[list[Literal]] = []
+        # 他のプロセスで作った節 (0区切りの変数番号の列)
+        self.raw_clauses = array('i')
+        self.num_raw_clauses = 0
         self.num_literals = 0
         self.id_to_literal: dict[int, Literal] = {}
+        self.simplifier: Simplifier | None = None
 
     def new_literal(self, *, name: str | None = None) -> Literal:
         self.num_literals += 1
@@ -31,16 +41,396 @@ class CnfComposer:
     def add_clause(self, literals: list[Literal]):
         self.clauses.append(literals)
 
+    def add_raw_clauses(self, clauses: array, count: int):
+        # 変数はnew_literalで割り当て済みであること
+        self.raw_clauses.extend(clauses)
+        self.num_raw_clauses += count
+
+    @property
+    def num_clauses(self) -> int:
+        return len(self.clauses) + self.num_raw_clauses
+
     def to_dimacs(self):
-        out = f'p cnf {self.num_literals} {len(self.clauses)}\n'
+        out = f'p cnf {self.num_literals} {self.num_clauses}\n'
         lines = []
         for clause in self.clauses:
             line = ' '.join(map(str, map(lambda x: x.id, clause))) + ' 0'
             lines.append(line)
+        if self.raw_clauses:
+            raw = ' '.join(map(str, self.raw_clauses))
+            lines.append(raw.replace(' 0 ', ' 0\n'))
         out += '\n'.join(lines)
         return out
 
-    def to_solver(self) -> Solver:
-        clauses = [[l.id for l in c] for c in self.clauses]
-        s = Solver(name='cadical153', bootstrap_with=clauses, use_timer=True)
+    def iter_clauses(self) -> Iterator[list[int]]:
+        # 全ての節を変数番号のリストとして返す
+        for c in self.clauses:
+            yield [l.id for l in c]
+        raw = self.raw_clauses.tolist()
+        start = 0
+        for k, l in enumerate(raw):
+            if l == 0:
+                yield raw[start:k]
+                start = k + 1
+
+    def to_solver(self, name: str = 'cadical153') -> Solver:
+        s = Solver(name=name, use_timer=True)
+        for clause in self.iter_clauses():
+            s.add_clause(clause)
         return s
+
+    def simplify(self, *, frozen: Iterable[Literal] = ()) -> 'Simplifier':
+        # 節を前処理で簡単化したものに置き換える
+        # frozenの変数は消去しない (後からブロッキング節や仮定で使う変数)
+        # 簡単化した後に節を足すときは、frozenの変数だけを使うこと
+        simplifier = Simplifier(
+            self.iter_clauses(),
+            self.num_literals,
+            frozen=[l.id for l in frozen])
+        simplifier.run()
+        self.clauses = []
+        self.raw_clauses = array('i')
+        self.num_raw_clauses = 0
+        for clause in simplifier.result():
+            self.raw_clauses.extend(clause)
+            self.raw_clauses.append(0)
+            self.num_raw_clauses += 1
+        self.simplifier = simplifier
+        return simplifier
+
+    def extend_model(self, model: list[int]) -> list[int]:
+        # ソルバのモデルを、簡単化で消した変数も含む元の変数全ての割り当てに戻す
+        if self.simplifier is None:
+            return model
+        return self.simplifier.extend(model)
+
+
+class Simplifier:
+    # 単位伝播, 重複・包含された節の除去, 自己包含による節の強化,
+    # 有界変数消去を行う
+    # 値が決まった変数と消去した変数は、(証拠のリテラル, 節)の組をスタックに積み、
+    # extendでスタックを逆順にたどって値を復元する
+    # これより多くの節に現れる変数は消去しない
+    MAX_OCCURRENCES = 16
+    # これより長い導出節ができる変数は消去しない
+    MAX_RESOLVENT = 20
+
+    def __init__(
+            self,
+            clauses: Iterable[Iterable[int]],
+            num_vars: int,
+            *,
+            frozen: Iterable[int] = ()) -> None:
+        self.num_vars = num_vars
+        self.frozen = set(frozen)
+        self.clauses: list[set[int] | None] = []
+        self.occurs: defaultdict[int, set[int]] = defaultdict(set)
+        self.units: list[int] = []
+        self.fixed: dict[int, int] = {}
+        self.eliminated: set[int] = set()
+        self.stack: list[tuple[int, tuple[int, ...]]] = []
+        self.unsat = False
+        self.elapsed = 0.0
+
+        self.num_clauses_before = 0
+        self.num_literals_before = 0
+        self.num_duplicates = 0
+        self.num_subsumed = 0
+        self.num_strengthened = 0
+
+        seen: set[frozenset[int]] = set()
+        for c in clauses:
+            lits = set(c)
+            self.num_clauses_before += 1
+            self.num_literals_before += len(lits)
+            if any(-l in lits for l in lits):
+                # 恒真な節
+                continue
+            key = frozenset(lits)
+            if key in seen:
+                self.num_duplicates += 1
+                continue
+            seen.add(key)
+            self._add(lits)
+
+    def _add(self, lits: set[int]):
+        if not lits:
+            self.unsat = True
+            return
+        if len(lits) == 1:
+            self.units.append(next(iter(lits)))
+        k = len(self.clauses)
+        self.clauses.append(lits)
+        for l in lits:
+            self.occurs[l].add(k)
+
+    def _remove(self, k: int):
+        c = self.clauses[k]
+        assert c is not None
+        for l in c:
+            self.occurs[l].discard(k)
+        self.clauses[k] = None
+
+    def _strengthen(self, k: int, lit: int):
+        # 節kからリテラルlitを除く
+        c = self.clauses[k]
+        assert c is not None
+        c.discard(lit)
+        self.occurs[lit].discard(k)
+        if len(c) == 1:
+            self.units.append(next(iter(c)))
+        elif not c:
+            self.unsat = True
+
+    def propagate(self):
+        while self.units and not self.unsat:
+            l = self.units.pop()
+            v = abs(l)
+            if v in self.fixed:
+                if self.fixed[v] != l:
+                    self.unsat = True
+                continue
+            self.fixed[v] = l
+            self.stack.append((l, (l,)))
+            for k in list(self.occurs[l]):
+                self._remove(k)
+            for k in list(self.occurs[-l]):
+                self._strengthen(k, -l)
+
+    def subsume(self):
+        # 短い節から順に、それを含む節を消し、自己包含できる節を強化する
+        order = sorted(
+            (k for k, c in enumerate(self.clauses) if c is not None),
+            key=lambda k: len(cast(set[int], self.clauses[k])))
+        for k in order:
+            if self.unsat:
+                return
+            c = self.clauses[k]
+            if c is None:
+                continue
+            # c ⊆ d なら d は不要
+            l0 = min(c, key=lambda l: len(self.occurs[l]))
+            for d in list(self.occurs[l0]):
+                dc = self.clauses[d]
+                if d != k and dc is not None and len(dc) >= len(c) \
+                        and c <= dc:
+                    self._remove(d)
+                    self.num_subsumed += 1
+            # c = l ∨ R, d ⊇ ¬l ∨ R なら d から ¬l を除ける
+            for l in list(c):
+                for d in list(self.occurs[-l]):
+                    dc = self.clauses[d]
+                    if dc is None or len(dc) < len(c):
+                        continue
+                    if all(x == l or x in dc for x in c):
+                        self._strengthen(d, -l)
+                        self.num_strengthened += 1
+            self.propagate()
+
+    def eliminate(self):
+        # 導出節の数が元の節の数を超えない変数を、出現の少ないものから消去する
+        candidates = [
+            v for v in range(1, self.num_vars + 1)
+            if v not in self.frozen and v not in self.fixed]
+        candidates.sort(key=lambda v: len(self.occurs[v]) + len(self.occurs[-v]))
+        for v in candidates:
+            if self.unsat:
+                return
+            if v in self.fixed:
+                continue
+            pos = list(self.occurs[v])
+            neg = list(self.occurs[-v])
+            limit = len(pos) + len(neg)
+            if limit == 0 or limit > self.MAX_OCCURRENCES:
+                continue
+            resolvents: list[set[int]] = []
+            ok = True
+            for p in pos:
+                for n in neg:
+                    r = (cast(set[int], self.clauses[p])
+                         | cast(set[int], self.clauses[n])) - {v, -v}
+                    if any(-x in r for x in r):
+                        continue
+                    if len(r) > self.MAX_RESOLVENT \
+                            or len(resolvents) >= limit:
+                        ok = False
+                        break
+                    resolvents.append(r)
+                if not ok:
+                    break
+            if not ok:
+                continue
+
+            # 少ない側の節を積み、最後に反対のリテラルの単位節を積む
+            # (復元時は反対のリテラルを仮に真とし、積んだ節が偽なら反転する)
+            lit = v
+            if len(pos) > len(neg):
+                pos, neg, lit = neg, pos, -v
+            for k in pos:
+                self.stack.append((lit, tuple(cast(set[int], self.clauses[k]))))
+            self.stack.append((-lit, (-lit,)))
+            for k in pos + neg:
+                self._remove(k)
+            self.eliminated.add(v)
+            for r in resolvents:
+                self._add(r)
+            self.propagate()
+
+    def run(self):
+        started = perf_counter()
+        self.propagate()
+        self.subsume()
+        self.eliminate()
+        self.subsume()
+        self.elapsed = perf_counter() - started
+
+    def result(self) -> list[list[int]]:
+        if self.unsat:
+            # 空節の代わりに矛盾する単位節の組を返す
+            return [[1], [-1]]
+        clauses = [sorted(c, key=abs) for c in self.clauses if c is not None]
+        # 値が決まった変数のうち、後から使われ得るものは単位節として残す
+        clauses.extend([l] for v, l in self.fixed.items() if v in self.frozen)
+        # どの節にも現れなくなった変数も、モデルに含まれるよう恒真な節で残す
+        clauses.extend(
+            [v, -v] for v in sorted(self.frozen)
+            if v not in self.fixed
+            and not self.occurs[v] and not self.occurs[-v])
+        return clauses
+
+    @property
+    def num_clauses(self) -> int:
+        return sum(1 for c in self.clauses if c is not None)
+
+    @property
+    def num_literals(self) -> int:
+        return sum(len(c) for c in self.clauses if c is not None)
+
+    def extend(self, model: list[int]) -> list[int]:
+        # 簡単化した節のモデルを、元の節のモデルに広げる
+        values = [0] + [-v for v in range(1, self.num_vars + 1)]
+        for l in model:
+            if abs(l) <= self.num_vars:
+                values[abs(l)] = l
+        for witness, clause in reversed(self.stack):
+            if not any(values[abs(x)] == x for x in clause):
+                values[abs(witness)] = witness
+        return values[1:]
+
+
+# 予算内に解けなかった(UNKNOWN)ときの終了コード
+EXIT_UNKNOWN = 3
+
+
+class Budget:
+    # 割り込みに対応していないソルバ(CaDiCaL)で時間制限を守るために、
+    # 衝突数の予算をこの単位で区切って解き直す
+    CONFLICT_CHUNK = 1000
+
+    def __init__(
+            self,
+            *,
+            time_limit: float | None = None,
+            conflict_limit: int | None = None,
+            propagation_limit: int | None = None) -> None:
+        # time_limitは最初のsolveからの通算、他の2つはsolve1回あたりの上限
+        self.time_limit = time_limit
+        self.conflict_limit = conflict_limit
+        self.propagation_limit = propagation_limit
+        self.deadline: float | None = None
+        self.exhausted = False
+
+    def is_unlimited(self) -> bool:
+        return self.time_limit is None \
+            and self.conflict_limit is None \
+            and self.propagation_limit is None
+
+    def solve(
+            self,
+            solver: Solver,
+            assumptions: Sequence[int] = ()) -> bool | None:
+        # 予算を使い切った場合はNoneを返す
+        if self.is_unlimited():
+            return solver.solve(assumptions=assumptions)
+
+        if self.propagation_limit is not None:
+            solver.prop_budget(self.propagation_limit)
+
+        if self.time_limit is None:
+            if self.conflict_limit is not None:
+                solver.conf_budget(self.conflict_limit)
+            return self._finish(solver.solve_limited(assumptions=assumptions))
+
+        if self.deadline is None:
+            self.deadline = monotonic() + self.time_limit
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            return self._finish(None)
+
+        try:
+            solver.interrupt()
+            solver.clear_interrupt()
+        except NotImplementedError:
+            return self._finish(self._solve_in_chunks(solver, assumptions))
+
+        if self.conflict_limit is not None:
+            solver.conf_budget(self.conflict_limit)
+        # 時間切れになったらタイマースレッドから割り込む
+        timer = Timer(remaining, solver.interrupt)
+        timer.start()
+        try:
+            status = solver.solve_limited(
+                assumptions=assumptions, expect_interrupt=True)
+        finally:
+            timer.cancel()
+            solver.clear_interrupt()
+        return self._finish(status)
+
+    def _solve_in_chunks(
+            self,
+            solver: Solver,
+            assumptions: Sequence[int]) -> bool | None:
+        assert self.deadline is not None
+        conflicts = 0
+        while monotonic() < self.deadline:
+            chunk = self.CONFLICT_CHUNK
+            if self.conflict_limit is not None:
+                chunk = min(chunk, self.conflict_limit - conflicts)
+                if chunk <= 0:
+                    return None
+            before = solver.accum_stats()['conflicts']
+            solver.conf_budget(chunk)
+            status = solver.solve_limited(assumptions=assumptions)
+            if status is not None:
+                return status
+            conflicts += solver.accum_stats()['conflicts'] - before
+        return None
+
+    def _finish(self, status: bool | None) -> bool | None:
+        if status is None:
+            self.exhausted = True
+        return status
+
+
+def enumerate_models(
+        solver: Solver,
+        projection: list[Literal],
+        *,
+        limit: int | None = None,
+        budget: Budget | None = None) -> Iterator[list[int]]:
+    # projectionへの割り当てが互いに異なるモデルを最大limit個列挙する
+    # モデルを見つけるたびにブロッキング節を追加し、ソルバはそのまま使い回す
+    # 予算を使い切った場合はbudget.exhaustedが立った状態で打ち切る
+    found = 0
+    while limit is None or found < limit:
+        if budget is not None:
+            status = budget.solve(solver)
+        else:
+            status = solver.solve()
+        if not status:
+            return
+        model = cast(list[int], solver.get_model())
+        yield model
+        found += 1
+        # 射影した変数の割り当てのみを否定する
+        solver.add_clause([-model[l.id-1] for l in projection])
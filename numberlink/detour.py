@@ -0,0 +1,283 @@
+from collections import deque
+from dataclasses import dataclass
+from array import array
+from functools import cache
+from typing import Iterator
+
+Cell = tuple[int, int]
+Edge = tuple[Cell, Cell]
+
+
+@dataclass(frozen=True, kw_only=True)
+class DetourPattern:
+    # 窓の大きさ
+    height: int
+    width: int
+    # 回り道の辺 (窓の左上を(0, 0)とする相対座標, 各辺は小さい方のマスが先)
+    path: tuple[Edge, ...]
+    # 回り道の両端
+    ends: tuple[Cell, Cell]
+    # 回り道の内側のマス (空白マスでなければ回り道は通れない)
+    interior: tuple[Cell, ...]
+    # 近道の内側のマス (空白マスでなければ近道できない)
+    shortcut: tuple[Cell, ...]
+    # 近道のマスが他の線に使われ得ないか
+    # Trueなら回り道の辺だけで節を作れる
+    enclosed: bool
+    # 回り道の一部がより小さな回り道になっている場合の、その近道のマス
+    # どれかが全て空白マスなら、小さい方の節で足りるので節を作らない
+    covered_by: tuple[tuple[Cell, ...], ...]
+
+
+def _neighbors(cell: Cell) -> list[Cell]:
+    r, c = cell
+    return [(r-1, c), (r, c-1), (r+1, c), (r, c+1)]
+
+
+def _edge(a: Cell, b: Cell) -> Edge:
+    return (a, b) if a < b else (b, a)
+
+
+def _shortest_path(
+        height: int,
+        width: int,
+        start: Cell,
+        goal: Cell,
+        blocked: set[Cell],
+        limit: int) -> list[Cell] | None:
+    # 窓の中でblockedを避けた、辺の数がlimit未満の最短経路 (startとgoalを含む)
+    # 残りをまっすぐ進んでもlimitに届くマスは、それ以上たどらない
+    prev: dict[Cell, Cell | None] = {start: None}
+    dist = {start: 0}
+    queue = deque([start])
+    while queue:
+        cur = queue.popleft()
+        if cur == goal:
+            path = [cur]
+            while (p := prev[path[-1]]) is not None:
+                path.append(p)
+            return path[::-1]
+        d = dist[cur] + 1
+        for n in _neighbors(cur):
+            if not (0 <= n[0] < height and 0 <= n[1] < width):
+                continue
+            if n in prev or n in blocked:
+                continue
+            if d + abs(n[0] - goal[0]) + abs(n[1] - goal[1]) >= limit:
+                continue
+            prev[n] = cur
+            dist[n] = d
+            queue.append(n)
+    return None
+
+
+def _find_shortcut(
+        height: int,
+        width: int,
+        path: list[Cell]) -> list[Cell] | None:
+    # pathの内側を通らずに両端を結ぶ、pathより短い経路があれば返す
+    return _shortest_path(
+        height, width, path[0], path[-1], set(path[1:-1]), len(path) - 1)
+
+
+def _make_pattern(
+        height: int,
+        width: int,
+        path: list[Cell],
+        shortcut: list[Cell],
+        covered_by: list[tuple[Cell, ...]]) -> DetourPattern:
+    interior = path[1:-1]
+    inner = shortcut[1:-1]
+    # 両端が隣接していれば、近道に使うマスはない
+    # 近道のマスが1つだけで、回り道の両端・内側以外に隣接するマスが高々1つなら、
+    # そのマスを他の線が通ることはできない。
+    # 同じ線が通っていれば、それはさらに短い経路かループを作るので近道できる。
+    enclosed = len(inner) == 0
+    if len(inner) == 1:
+        foreign = [n for n in _neighbors(inner[0]) if n not in path]
+        enclosed = len(foreign) <= 1
+    return DetourPattern(
+        height=height,
+        width=width,
+        path=tuple(_edge(a, b) for a, b in zip(path, path[1:])),
+        ends=(path[0], path[-1]),
+        interior=tuple(interior),
+        shortcut=tuple(inner),
+        enclosed=enclosed,
+        covered_by=tuple(dict.fromkeys(covered_by)),
+    )
+
+
+def _enumerate_window(height: int, width: int) -> list[DetourPattern]:
+    # 窓の中の単純経路を深さ優先で列挙し、窓いっぱいに広がる回り道を集める
+    # 両端が隣接する回り道(U字)はマスの種類によらず禁止できるので、
+    # それを含む経路はそれ以上伸ばさない。
+    # それ以外の回り道を含む経路は、その近道のマスが数字マスのときのために残す。
+    found: dict[frozenset[Edge], DetourPattern] = {}
+    # 近道の有無は両端と内側のマスの集合だけで決まり、
+    # 異なる経路の部分経路として何度も現れるので覚えておく
+    shortcuts: dict[tuple[Cell, Cell, frozenset[Cell]], list[Cell] | None] = {}
+
+    def shortcut_of(sub: list[Cell]) -> list[Cell] | None:
+        # 既にマンハッタン距離の長さなら、それより短い経路はない
+        (r0, c0), (r1, c1) = sub[0], sub[-1]
+        if len(sub) - 1 <= abs(r0 - r1) + abs(c0 - c1):
+            return None
+        key = (sub[0], sub[-1], frozenset(sub[1:-1]))
+        if key not in shortcuts:
+            shortcuts[key] = _find_shortcut(height, width, sub)
+        return shortcuts[key]
+
+    def visit(path: list[Cell], covered_by: list[tuple[Cell, ...]]):
+        for n in _neighbors(path[-1]):
+            if not (0 <= n[0] < height and 0 <= n[1] < width):
+                continue
+            if n in path:
+                continue
+            path.append(n)
+            # 新しいマスで終わる部分経路のうち、回り道になっているものを探す
+            redundant: list[tuple[int, list[Cell]]] = []
+            for k in range(len(path) - 3, -1, -1):
+                shortcut = shortcut_of(path[k:])
+                if shortcut is not None:
+                    redundant.append((k, shortcut))
+            is_u_turn = any(len(sc) == 2 for k, sc in redundant if k > 0)
+            if not is_u_turn:
+                subs = covered_by + [tuple(sc[1:-1])
+                                     for k, sc in redundant if k > 0]
+                rows = {r for r, _ in path}
+                cols = {c for _, c in path}
+                # 小さい回り道は小さい窓で数える
+                if redundant and redundant[-1][0] == 0 \
+                        and len(rows) == height and len(cols) == width:
+                    pattern = _make_pattern(
+                        height, width, path, redundant[-1][1], subs)
+                    found.setdefault(frozenset(pattern.path), pattern)
+                if not any(len(sc) == 2 for _, sc in redundant):
+                    visit(path, subs + [tuple(sc[1:-1])
+                                        for k, sc in redundant if k == 0])
+            path.pop()
+
+    for r in range(height):
+        for c in range(width):
+            visit([(r, c)], [])
+    return list(found.values())
+
+
+def _transpose(pattern: DetourPattern) -> DetourPattern:
+    def t(cell: Cell) -> Cell:
+        return (cell[1], cell[0])
+    return DetourPattern(
+        height=pattern.width,
+        width=pattern.height,
+        path=tuple(_edge(t(a), t(b)) for a, b in pattern.path),
+        ends=(t(pattern.ends[0]), t(pattern.ends[1])),
+        interior=tuple(map(t, pattern.interior)),
+        shortcut=tuple(map(t, pattern.shortcut)),
+        enclosed=pattern.enclosed,
+        covered_by=tuple(tuple(map(t, cells)) for cells in pattern.covered_by),
+    )
+
+
+@cache
+def generate_patterns(size: int) -> tuple[DetourPattern, ...]:
+    # 長辺がsizeの窓 (size x w, w x size, w <= size) に収まる回り道を全て返す
+    # 窓の中の反転・回転はDFSで自然に現れるので、辺集合で重複を除く。
+    # 縦長の窓は横長の窓の転置として作る。
+    patterns: list[DetourPattern] = []
+    for height in range(2, size + 1):
+        window = _enumerate_window(height, size)
+        patterns.extend(window)
+        if height != size:
+            patterns.extend(map(_transpose, window))
+    return tuple(patterns)
+
+
+def _place(
+        pat: DetourPattern,
+        i: int,
+        j: int,
+        height: int,
+        width: int,
+        hint_ends: set[Cell]) -> list[tuple[Edge, bool]]:
+    # 窓の左上を(i, j)に置いたときの節 (hint_endsは数字マスである端点)
+    def at(cell: Cell) -> Cell:
+        return (i+cell[0], j+cell[1])
+
+    clause = [((at(a), at(b)), False) for a, b in pat.path]
+    if not pat.enclosed:
+        # 近道のマスが他の線に使われていないことを条件に加える
+        # 回り道の内側のマスとの辺は、次数の制約から自動的に偽になる
+        # 数字マスの端点は、回り道の辺で次数を使い切っている
+        skip = set(pat.interior) | set(pat.shortcut) | hint_ends
+        for cell in pat.shortcut:
+            for n in _neighbors(cell):
+                if n in skip:
+                    continue
+                if not (0 <= i+n[0] < height and 0 <= j+n[1] < width):
+                    continue
+                clause.append((_edge(at(cell), at(n)), True))
+    return clause
+
+
+def detour_clauses(
+        grid: array,
+        height: int,
+        width: int,
+        window: int,
+        rows: range | None = None) -> Iterator[list[tuple[Edge, bool]]]:
+    # 長辺がwindow以下の窓に収まる回り道を禁止する節を、盤面の絶対座標で返す
+    # gridはNumberlink.gridと同じ行優先の盤面 (0が空白マス)
+    # 節の各リテラルは(辺, 正か)で、辺は小さい方のマスが先
+    # rowsを指定すると、窓の上端がrowsに含まれる節だけを返す
+    if rows is None:
+        rows = range(height)
+
+    # 盤面の長辺より大きな窓の回り道は置けないので、列挙もしない
+    for size in range(2, min(window, max(height, width)) + 1):
+        for pat in generate_patterns(size):
+            for i in rows:
+                if i + pat.height > height:
+                    break
+                for j in range(width - pat.width + 1):
+                    def blank(cell: Cell) -> bool:
+                        return grid[(i+cell[0]) * width + j+cell[1]] == 0
+
+                    # 数字マスを通る回り道や、数字マスを通る近道は考えない
+                    # (以前の手書きの節は内側が数字マスの位置にも置いていたので、
+                    # 節の集合は一致しない。数字マスに繋がる辺はちょうど1本なので、
+                    # 数字マスを通り抜ける回り道は元から禁止されており、省いてよい)
+                    if not all(map(blank, pat.interior)):
+                        continue
+                    if not all(map(blank, pat.shortcut)):
+                        continue
+                    # より小さな回り道の節で禁止済み
+                    if any(all(map(blank, cells))
+                           for cells in pat.covered_by):
+                        continue
+
+                    hint_ends = {c for c in pat.ends if not blank(c)}
+                    yield _place(pat, i, j, height, width, hint_ends)
+
+
+def skeleton_detour_clauses(
+        height: int,
+        width: int,
+        window: int,
+        rows: range | None = None) -> Iterator[tuple[list[tuple[Edge, bool]], list[Cell]]]:
+    # 数字マスの位置によらない形の節と、節が有効になるために空白マスであるべきマス
+    # 端点が数字マスでも成り立つよう、端点との辺も近道の条件に残す
+    # (より小さな回り道で禁止済みかどうかは盤面によるので、間引かない)
+    # rowsはdetour_clausesと同じ
+    if rows is None:
+        rows = range(height)
+
+    for size in range(2, min(window, max(height, width)) + 1):
+        for pat in generate_patterns(size):
+            for i in rows:
+                if i + pat.height > height:
+                    break
+                for j in range(width - pat.width + 1):
+                    blanks = [(i+r, j+c)
+                              for r, c in pat.interior + pat.shortcut]
+                    yield _place(pat, i, j, height, width, set()), blanks
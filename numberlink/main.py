@@ -1,214 +1,21 @@
 from argparse import ArgumentParser
-from dataclasses import dataclass
-from enum import Enum
-from typing import TypeVar, cast
-
-from cnf import CnfComposer, Literal
-
-T = TypeVar('T')
-Matrix = list[list[T]]
-
-
-@dataclass(frozen=True, kw_only=True)
-class Hint:
-    n: int
-    row: int
-    col: int
-
-
-class Pattern(Enum):
-    TOP_LEFT = 1
-    TOP = 2
-    LEFT = 3
-    CENTER = 4
-    TOP_RIGHT = 5
-    BOTTOM_LEFT = 6
-    RIGHT = 7
-    BOTTOM = 8
-    BOTTOM_RIGHT = 9
-
-
-@dataclass(frozen=True, kw_only=True)
-class Numberlink:
-    name = 'numberlink'
-    rows: int
-    cols: int
-    num_lines: int
-    hints: tuple[Hint, ...]
-    is_blank: Matrix[bool]
-
-    def get_cell_pattern(self, row: int, col: int) -> Pattern:
-        # パターン分け (4x7の場合)
-        # 1. 左上
-        # 2. 上辺
-        # 3. 左辺
-        # 4. 中央
-        # 5. 右上
-        # 6. 左下
-        # 7. 右辺
-        # 8. 下辺
-        # 9. 右下
-        #    | 0 | 1 | 2 | 3 | 4 | 5 | 6 |
-        #  ─ ┏━━━┯━━━┯━━━┯━━━┯━━━┯━━━┯━━━┓
-        #  0 ┃ 1 │ 2 │ 2 │ 2 │ 2 │ 2 │ 5 ┃
-        #  ─ ┠───┼───┼───┼───┼───┼───┼───┨
-        #  1 ┃ 3 │ 4 │ 4 │ 4 │ 4 │ 4 │ 7 ┃
-        #  ─ ┠───┼───┼───┼───┼───┼───┼───┨
-        #  2 ┃ 3 │ 4 │ 4 │ 4 │ 4 │ 4 │ 7 ┃
-        #  ─ ┠───┼───┼───┼───┼───┼───┼───┨
-        #  3 ┃ 6 │ 8 │ 8 │ 8 │ 8 │ 8 │ 9 ┃
-        #  ─ ┗━━━┷━━━┷━━━┷━━━┷━━━┷━━━┷━━━┛
-        top = row == 0
-        bottom = row == self.rows-1
-        left = col == 0
-        right = col == self.cols-1
-        if top and left:
-            return Pattern.TOP_LEFT
-        elif top and right:
-            return Pattern.TOP_RIGHT
-        elif bottom and left:
-            return Pattern.BOTTOM_LEFT
-        elif bottom and right:
-            return Pattern.BOTTOM_RIGHT
-        elif top:
-            return Pattern.TOP
-        elif bottom:
-            return Pattern.BOTTOM
-        elif left:
-            return Pattern.LEFT
-        elif right:
-            return Pattern.RIGHT
-        return Pattern.CENTER
-
-    def show(self, *, with_answer: tuple[Matrix[bool], Matrix[bool]] | None = None):
-        answer_s: Matrix[bool] | None = None
-        answer_e: Matrix[bool] | None = None
-        if with_answer is not None:
-            answer_s, answer_e = with_answer
-
-        grid = [['' for _ in range(self.cols)] for _ in range(self.rows)]
-        for h in self.hints:
-            grid[h.row][h.col] = str(h.n + 1)
-
-        output = '┌' + '───┬' * (self.cols-1) + '───┐\n'
-        for i in range(self.rows):
-            for j in range(self.cols):
-                north = answer_s is not None \
-                    and i != 0 and answer_s[i-1][j]
-                south = answer_s is not None \
-                    and i != self.rows-1 and answer_s[i][j]
-                east = answer_e is not None \
-                    and j != self.cols-1 and answer_e[i][j]
-                west = answer_e is not None \
-                    and j != 0 and answer_e[i][j-1]
-
-                if j == 0:
-                    output += '│'
-                if grid[i][j]:
-                    output += f'{grid[i][j]:^3}'
-                elif north and south:
-                    output += ' ┃ '
-                elif east and west:
-                    output += '━━━'
-                elif north and east:
-                    output += ' ┗━'
-                elif north and west:
-                    output += '━┛ '
-                elif south and east:
-                    output += ' ┏━'
-                elif south and west:
-                    output += '━┓ '
-                else:
-                    output += '   '
-                if east:
-                    output += '┿'
-                else:
-                    output += '│'
-            output += '\n'
-
-            if i == self.rows-1:
-                continue
-            for j in range(self.cols):
-                if j == 0:
-                    output += '├'
-                if answer_s is not None and answer_s[i][j]:
-                    output += '─╂─'
-                else:
-                    output += '───'
-                if j == self.cols-1:
-                    output += '┤'
-                else:
-                    output += '┼'
-            output += '\n'
-
-        output += '└' + '───┴' * (self.cols-1) + '───┘'
-
-        print(output)
-
-
-def load_problem(filename: str) -> Numberlink:
-    nl_rows = 0
-    nl_cols = 0
-    nl_line_num = 0
-    hints: list[Hint] = []
-    with open(filename) as f:
-        for line in f.readlines():
-            line = line.strip()
-            if line == '' or line.startswith('#'):
-                # if line is empty or comment, skip
-                continue
-
-            parts = line.split()
-            if parts[0] == 'SIZE':
-                # SIZE 10X10
-                cols, rows = map(int, parts[1].split('X'))
-                nl_rows = rows
-                nl_cols = cols
-            elif parts[0] == 'LINE_NUM':
-                # LINE_NUM 7
-                nl_line_num = int(parts[1])
-            else:
-                # LINE#1 (8,1)-(8,8)
-                n = int(parts[0].split('#')[1])
-                ps = parts[1].split('-')
-                p1_text = ps[0].removeprefix('(').removesuffix(')')
-                p1_col, p1_row = map(int, p1_text.split(','))
-                p1 = Hint(n=n-1, row=p1_row, col=p1_col)
-                p2_text = ps[1].removeprefix('(').removesuffix(')')
-                p2_col, p2_row = map(int, p2_text.split(','))
-                p2 = Hint(n=n-1, row=p2_row, col=p2_col)
-                hints.append(p1)
-                hints.append(p2)
-
-    is_blank: Matrix[bool] = []
-    for i in range(nl_rows):
-        is_blank.append([])
-        for j in range(nl_cols):
-            is_blank[i].append(True)
-    for h in hints:
-        is_blank[h.row][h.col] = False
-
-    return Numberlink(
-        rows=nl_rows,
-        cols=nl_cols,
-        num_lines=nl_line_num,
-        hints=tuple(hints),
-        is_blank=is_blank,
-    )
-
-
-class Constraint(Enum):
-    BASIC = 1
-    U_SHAPE = 2
-    U_SHAPE_LONG = 3
-
-    def __str__(self) -> str:
-        return str(self.value)
-
-    @classmethod
-    def from_string(cls, s: str) -> 'Constraint':
-        return cls(int(s))
-
+import json
+from operator import itemgetter
+import sys
+from time import perf_counter
+from typing import TextIO, cast
+
+from pysat.solvers import Solver
+
+from cnf import EXIT_UNKNOWN, Budget, CnfComposer, Literal, enumerate_models
+from pool import SolverPool
+from problem import Matrix, Numberlink, load_problem, load_problems
+from routing import route_greedily
+from search import search_paths
+from selector import load_selector
+from shard import Layout, encode_sharded
+from verify import (count_differences, find_answer_file, load_answer,
+                    verify_answer, write_answer)
 
 parser = ArgumentParser(
     prog='numberlink solver',
@@ -218,14 +25,39 @@ parser.add_argument(
     'filename',
     help='problem file',
 )
+parser.add_argument(
+    '--problem',
+    type=int,
+    default=1,
+    metavar='K',
+    help='solve the K-th problem of a file holding several problems',
+)
+parser.add_argument(
+    '--pool',
+    type=int,
+    metavar='N',
+    help='solve every problem in the file, reusing one incremental solver '
+    'per board size (keeping at most N of them)',
+)
 parser.add_argument(
     '-c', '--constraint',
-    choices=[Constraint.U_SHAPE, Constraint.U_SHAPE_LONG],
+    # 5x5の窓は回り道の列挙だけで数秒かかり、盤面の大きさに見合わない
+    choices=range(2, 5),
     default=[],
-    type=Constraint.from_string,
-    help='select constraint',
+    type=int,
+    metavar='K',
+    help='forbid detours within windows up to KxK '
+    '(2: u-shape, 3: u-shape-long; the largest K given is used)',
     nargs='+',
 )
+parser.add_argument(
+    '--auto',
+    nargs='?',
+    const='numberlink/selector.json',
+    metavar='SELECTOR',
+    help='pick -c and --solver from the board features with a selector '
+    'fitted by numberlink/tune.py (overrides -c and --solver)',
+)
 parser.add_argument(
     '-t', '--show-only-elapsed-time',
     action='store_true',
@@ -235,11 +67,440 @@ parser.add_argument(
     '-o', '--output',
     help='output dimacs file',
 )
+parser.add_argument(
+    '--format',
+    choices=['box', 'adc', 'json'],
+    default='box',
+    help='answer output format (adc: ADC2014 answer file, with the '
+    '--count/--unique summary on stderr; json: one line per answer, plus a '
+    'summary line with --count/--unique; both skip drawing the board)',
+)
+parser.add_argument(
+    '--show-size',
+    action='store_true',
+    help='show the number of variables and clauses',
+)
+parser.add_argument(
+    '--show-stats',
+    action='store_true',
+    help='show solver statistics (conflicts, decisions, ...)',
+)
+parser.add_argument(
+    '--simplify',
+    action='store_true',
+    help='simplify the CNF before solving (unit propagation, subsumption, '
+    'variable elimination); -t then includes the simplification time',
+)
+parser.add_argument(
+    '--local-search',
+    type=float,
+    metavar='SECONDS',
+    help='first try routing the lines by rip-up-and-reroute local search for '
+    'up to SECONDS, and encode to SAT only if that fails',
+)
+parser.add_argument(
+    '--phase',
+    action='store_true',
+    help='seed solver phases from a greedy shortest-path routing',
+)
+parser.add_argument(
+    '--count',
+    type=int,
+    metavar='N',
+    help='enumerate up to N answers (0 for all)',
+)
+parser.add_argument(
+    '--unique',
+    action='store_true',
+    help='check whether the answer is unique',
+)
+parser.add_argument(
+    '--verify',
+    nargs='?',
+    const='',
+    metavar='ANSWER',
+    help='verify the answer (compare with ANSWER, or the ADC2014 answer file '
+    'matching the problem if omitted)',
+)
+parser.add_argument(
+    '-j', '--jobs',
+    type=int,
+    metavar='N',
+    help='generate clauses in N worker processes, one band of rows each '
+    '(for very large boards)',
+)
+parser.add_argument(
+    '--solver',
+    default='cadical153',
+    help='SAT solver name (e.g. cadical153, glucose42, minisat22)',
+)
+parser.add_argument(
+    '--time-limit',
+    type=float,
+    metavar='SECONDS',
+    help='give up and report UNKNOWN after SECONDS',
+)
+parser.add_argument(
+    '--conflict-limit',
+    type=int,
+    metavar='N',
+    help='give up and report UNKNOWN after N conflicts',
+)
+parser.add_argument(
+    '--propagation-limit',
+    type=int,
+    metavar='N',
+    help='give up and report UNKNOWN after N propagations '
+    '(not supported by cadical)',
+)
 opts = parser.parse_args()
 
 
+def make_budget() -> Budget:
+    return Budget(
+        time_limit=opts.time_limit,
+        conflict_limit=opts.conflict_limit,
+        propagation_limit=opts.propagation_limit,
+    )
+
+
+def show_statistics(solver: Solver, out: TextIO = sys.stdout):
+    # 予算切れで打ち切った場合も、そこまでの統計を出す
+    stats = solver.accum_stats() or {}
+    items = [f'{k}={v}' for k, v in stats.items()]
+    items.append(f'time={solver.time_accum():.6f}')
+    print('Statistics: ' + ', '.join(items), file=out)
+
+
+def decode_answer(
+        nl: Numberlink,
+        model: list[int],
+        s: Matrix[Literal],
+        e: Matrix[Literal]) -> tuple[Matrix[bool], Matrix[bool]]:
+    # s, eの値をitemgetterでまとめて取り出してから、行ごとに切り分ける
+    def gather(literals: Matrix[Literal], width: int) -> Matrix[bool]:
+        ids = [l.id - 1 for row in literals for l in row]
+        if not ids:
+            return [[] for _ in literals]
+        values = itemgetter(*ids)(model) if len(ids) > 1 \
+            else (model[ids[0]],)
+        return [[v > 0 for v in values[k:k+width]]
+                for k in range(0, len(values), width)]
+
+    return gather(s, nl.cols), gather(e, nl.cols-1)
+
+
+def show_answer(
+        nl: Numberlink,
+        answer_s: Matrix[bool],
+        answer_e: Matrix[bool],
+        index: int | None = None):
+    if opts.format == 'box':
+        nl.show(with_answer=(answer_s, answer_e))
+        return
+    # 一括実行向けに、罫線を描かずに各マスの線の番号だけを出す
+    labels = verify_answer(nl, answer_s, answer_e).labels
+    if opts.format == 'adc':
+        write_answer(nl, labels, sys.stdout)
+    else:
+        # --poolのときは、ファイル中の何問目か(1-indexed)も出す
+        record: dict[str, object] = {'problem': opts.filename}
+        if index is not None:
+            record['index'] = index
+        record['status'] = 'SAT'
+        record['rows'] = nl.rows
+        record['cols'] = nl.cols
+        record['labels'] = [[v + 1 for v in row] for row in labels]
+        print(json.dumps(record))
+
+
+def show_status(status: str, index: int | None = None):
+    # 解がなかった(UNSAT)または予算切れ(UNKNOWN)のときの出力
+    if opts.format == 'json':
+        record: dict[str, object] = {'problem': opts.filename}
+        if index is not None:
+            record['index'] = index
+        record['status'] = status
+        print(json.dumps(record))
+    else:
+        print(status)
+
+
+def show_count_summary(
+        num_answers: int,
+        limit: int | None,
+        elapsed: float,
+        exhausted: bool):
+    # --formatがjsonのときの、解を数え終えた後の1行
+    # completeは全ての解を数えきったかどうか
+    record: dict[str, object] = {'problem': opts.filename}
+    if exhausted:
+        # 見つかった解の数は下限でしかない
+        record['status'] = 'UNKNOWN'
+    elif opts.unique:
+        record['status'] = ['UNSAT', 'UNIQUE', 'NOT UNIQUE'][num_answers]
+    record['answers'] = num_answers
+    record['complete'] = not exhausted \
+        and (limit is None or num_answers < limit)
+    record['elapsed'] = elapsed
+    print(json.dumps(record))
+
+
+def count_answers(
+        nl: Numberlink,
+        cc: CnfComposer,
+        solver: Solver,
+        s: Matrix[Literal],
+        e: Matrix[Literal]):
+    budget = make_budget()
+    # --uniqueは2つ目の解が見つかった時点で打ち切る
+    if opts.unique:
+        limit = 2
+    elif opts.count:
+        limit = opts.count
+    else:
+        limit = None
+
+    # 線の配置(s, e)だけが異なる解を数える
+    # 線が通らない空白マスのxは自由なので、射影しないと同じ解を重複して数える
+    projection = [l for row in s for l in row] + [l for row in e for l in row]
+    num_answers = 0
+    models = enumerate_models(solver, projection, limit=limit, budget=budget)
+    for model in models:
+        num_answers += 1
+        if not opts.show_only_elapsed_time:
+            if opts.format == 'box':
+                print(f'Answer #{num_answers}:')
+            show_answer(nl, *decode_answer(nl, cc.extend_model(model), s, e))
+
+    elapsed = solver.time_accum()
+    if opts.format == 'json':
+        # 解と同じく1行のJSONにして、出力全体を1行1つのJSONのまま保つ
+        show_count_summary(num_answers, limit, elapsed, budget.exhausted)
+        if budget.exhausted:
+            if opts.show_stats:
+                show_statistics(solver)
+            sys.exit(EXIT_UNKNOWN)
+        return
+    # adcでは標準出力を解答ファイルだけにするため、集計は標準エラー出力に出す
+    out = sys.stderr if opts.format == 'adc' else sys.stdout
+    rate = num_answers / elapsed if elapsed > 0 else float('inf')
+    if budget.exhausted:
+        status = ' (budget exhausted)'
+    elif limit is None or num_answers < limit:
+        status = ' (all)'
+    else:
+        status = ' (limit reached)'
+    print(f'Answers: {num_answers}' + status, file=out)
+    print(f'Elapsed: {elapsed:.6f}s ({rate:.1f} answers/s)', file=out)
+    if budget.exhausted:
+        # 見つかった解の数は下限でしかない
+        print('UNKNOWN', file=out)
+        show_statistics(solver, out)
+        sys.exit(EXIT_UNKNOWN)
+    if opts.unique:
+        if num_answers == 0:
+            print('UNSAT', file=out)
+        elif num_answers == 1:
+            print('UNIQUE', file=out)
+        else:
+            print('NOT UNIQUE', file=out)
+
+
+def show_verification(
+        nl: Numberlink,
+        answer_s: Matrix[bool],
+        answer_e: Matrix[bool]):
+    result = verify_answer(nl, answer_s, answer_e)
+    if result.ok:
+        print('Verification: OK')
+    else:
+        print('Verification: NG')
+        for error in result.errors:
+            print(f'  {error}')
+
+    answer_file = opts.verify or find_answer_file(opts.filename)
+    if answer_file is None:
+        return
+    diff = count_differences(result.labels, load_answer(answer_file))
+    # 空白マスの埋め方は複数あり得るので、差分があっても誤りとは限らない
+    print(f'Reference: {answer_file} ({diff} cells differ)')
+
+
+def seed_phases(
+        solver: Solver,
+        nl: Numberlink,
+        s: Matrix[Literal],
+        e: Matrix[Literal],
+        x: Matrix[list[Literal]]) -> int:
+    # 各線を最短経路で引いた盤面を、s, e, xの初期値としてソルバに与える
+    # 経路上の変数だけを真に寄せ、残りはソルバの既定の極性に任せる
+    # (経路外を全て偽に固定すると、経路が外れたときに探索が大きく遅くなる)
+    routes = route_greedily(nl)
+    phases: list[int] = []
+    for n, path in routes.items():
+        for (i1, j1), (i2, j2) in zip(path, path[1:]):
+            if i1 == i2:
+                phases.append(e[i1][min(j1, j2)].id)
+            else:
+                phases.append(s[min(i1, i2)][j1].id)
+        for i, j in path:
+            phases.append(x[i][j][n].id)
+    solver.set_phases(phases)
+    return len(routes)
+
+
+def add_clauses(
+        cc: CnfComposer,
+        nl: Numberlink,
+        x: Matrix[list[Literal]],
+        jobs: int):
+    # 数字マスの単位節以外はshard.pyで作る (jobsが2以上なら行の帯ごとに別プロセスで作る)
+    # 変数番号はLayoutから計算するので、割り当て順が一致している必要がある
+    layout = Layout(rows=nl.rows, cols=nl.cols, num_lines=nl.num_lines)
+    assert cc.num_literals == layout.num_vars
+    for h in nl.hints:
+        cc.add_clause([x[h.row][h.col][h.n]])
+    clauses, count = encode_sharded(
+        nl, max(opts.constraint, default=0), jobs)
+    cc.add_raw_clauses(clauses, count)
+
+
+def show_search_answer(
+        nl: Numberlink,
+        answer: tuple[Matrix[bool], Matrix[bool]],
+        elapsed: float):
+    # 局所探索で見つかった解をSATの解と同じ形で出す
+    answer_s, answer_e = answer
+    if opts.show_only_elapsed_time:
+        print(elapsed)
+        if opts.verify is not None:
+            result = verify_answer(nl, answer_s, answer_e)
+            print('VERIFIED' if result.ok else 'INVALID')
+        return
+    if opts.format == 'box':
+        print('Problem:')
+        nl.show()
+        print(f'Local search: found in {elapsed:.3f}s')
+        print('Answer:')
+    show_answer(nl, answer_s, answer_e)
+    if opts.verify is not None:
+        show_verification(nl, answer_s, answer_e)
+
+
+def solve_pooled():
+    # ファイル中の全ての問題を、大きさの分類ごとに使い回すソルバで解く
+    # 同じ大きさの盤面が続けば、節の生成は最初の1回だけで済む
+    if opts.pool < 1:
+        parser.error('--pool must be at least 1')
+    if opts.count is not None or opts.unique:
+        parser.error('--pool cannot be combined with --count/--unique')
+    if opts.output is not None or opts.jobs is not None or opts.phase \
+            or opts.simplify or opts.local_search is not None:
+        parser.error('--pool cannot be combined with -o, -j, --phase, '
+                     '--simplify or --local-search')
+    try:
+        problems = load_problems(opts.filename)
+    except ValueError as err:
+        parser.error(str(err))
+
+    window = max(opts.constraint, default=0)
+    pool = SolverPool(opts.pool, opts.solver)
+    unknown = False
+    encode_total = 0.0
+    try:
+        for k, nl in enumerate(problems, 1):
+            skeleton, reused = pool.get(nl, window)
+            encode = 0.0 if reused else skeleton.encode_elapsed
+            encode_total += encode
+            solver = skeleton.solver
+            before = solver.time_accum()
+            try:
+                is_satisfiable = skeleton.solve(nl, make_budget())
+            except NotImplementedError as err:
+                parser.error(f'{opts.solver}: {err}')
+            elapsed = solver.time_accum() - before
+
+            answer = None
+            if is_satisfiable:
+                model = cast(list[int], solver.get_model())
+                answer = decode_answer(nl, model, skeleton.s, skeleton.e)
+            if is_satisfiable is None:
+                status = 'UNKNOWN'
+                unknown = True
+            elif not is_satisfiable:
+                status = 'UNSAT'
+            elif opts.verify is not None:
+                assert answer is not None
+                result = verify_answer(nl, *answer)
+                status = 'VERIFIED' if result.ok else 'INVALID'
+            else:
+                status = 'SAT'
+
+            if opts.show_only_elapsed_time:
+                print(k, encode, elapsed, status)
+                continue
+            if opts.format == 'box':
+                source = 'reused' if reused else 'built'
+                print(f'Problem #{k}: {nl.rows}x{nl.cols}, '
+                      f'{nl.num_lines} lines, skeleton {source} '
+                      f'(encode {encode:.3f}s, solve {elapsed:.3f}s)')
+            if answer is None:
+                show_status(status, k)
+            else:
+                show_answer(nl, *answer, k)
+                if opts.verify is not None and opts.format == 'box':
+                    print(status)
+    finally:
+        pool.close()
+
+    if opts.show_only_elapsed_time or opts.format == 'box':
+        print(f'Pool: {pool.hits} reused, {pool.misses} built, '
+              f'{pool.evictions} evicted, encode {encode_total:.3f}s')
+    if unknown:
+        sys.exit(EXIT_UNKNOWN)
+
+
 def main():
-    nl = load_problem(opts.filename)
+    if opts.pool is not None:
+        if opts.auto is not None:
+            parser.error('--pool cannot be combined with --auto')
+        solve_pooled()
+        return
+    try:
+        nl = load_problem(opts.filename, opts.problem - 1)
+    except ValueError as err:
+        parser.error(str(err))
+
+    if opts.auto is not None:
+        try:
+            selector = load_selector(opts.auto)
+        except (OSError, ValueError) as err:
+            parser.error(f'--auto: {err}')
+        config, near = selector.choose(nl)
+        opts.constraint = list(config.constraint)
+        opts.solver = config.solver
+        if not opts.show_only_elapsed_time and opts.format == 'box':
+            print(f'Auto: {config.args} (from '
+                  + ', '.join(i.problem for i in near) + ')')
+
+    search_elapsed = 0.0
+    if opts.local_search is not None:
+        # 解を1つ見つけるだけなので、解を数えるときは使えない
+        if opts.count is not None or opts.unique or opts.output is not None:
+            parser.error('--local-search cannot be combined with '
+                         '--count/--unique or -o')
+        result = search_paths(nl, opts.local_search)
+        search_elapsed = result.elapsed
+        if result.answer is not None:
+            show_search_answer(nl, result.answer, result.elapsed)
+            return
+        if not opts.show_only_elapsed_time and opts.format == 'box':
+            print(f'Local search: gave up after {result.elapsed:.3f}s '
+                  f'({result.reroutes} reroutes, '
+                  f'{result.conflicts} cells still shared); '
+                  f'falling back to SAT')
+
     cc = CnfComposer()
 
     # s_ijは(i, j)から下に線が伸びているかどうか
@@ -268,340 +529,100 @@ def main():
             x[i].append([])
             for n in range(nl.num_lines):
                 x[i][j].append(cc.new_literal(name=f'x_{i}{j}{n}'))
-            # at least one x_ijn is true
-            # cc.add_clause(x[i][j])
-            # at most one x_ijn is true
-            for a in range(nl.num_lines):
-                for b in range(a + 1, nl.num_lines):
-                    cc.add_clause([-x[i][j][a], -x[i][j][b]])
-
-    for h in nl.hints:
-        cc.add_clause([x[h.row][h.col][h.n]])
-
-    # 1. 空白マス(i, j)から線が2本出るか、1本も出ない
-    # 2. 数字マス(i, j)から線が1本だけ出る
-    for i in range(nl.rows):
-        for j in range(nl.cols):
-            # 上のマスから線が出ているかどうか
-            # p1 = s[i-1][j]
-            # 左のマスから線が出ているかどうか
-            # p2 = e[i][j-1]
-            # 下のマスへ線が出ているかどうか
-            # p3 = s[i][j]
-            # 右のマスへ線が出ているかどうか
-            # p4 = e[i][j]
-
-            pat = nl.get_cell_pattern(i, j)
-            if nl.is_blank[i][j]:  # 空白マスの場合
-                if pat == Pattern.TOP_LEFT:  # パターン1: 左上
-                    p3 = s[i][j]
-                    p4 = e[i][j]
-                    # s_ij + e_ij <= 2は自動的に成立する
-                    # s_ij + e_ij != 1
-                    cc.add_clause([-p3, p4])
-                    cc.add_clause([p3, -p4])
-                elif pat == Pattern.TOP:  # パターン2: 上辺
-                    p2 = e[i][j-1]
-                    p3 = s[i][j]
-                    p4 = e[i][j]
-                    # e_i(j-1) + s_ij + e_ij <= 2
-                    cc.add_clause([-p2, -p3, -p4])
-                    # e_i(j-1) + s_ij + e_ij != 1
-                    cc.add_clause([-p2, p3, p4])
-                    cc.add_clause([p2, -p3, p4])
-                    cc.add_clause([p2, p3, -p4])
-                elif pat == Pattern.LEFT:  # パターン3: 左辺
-                    p1 = s[i-1][j]
-                    p3 = s[i][j]
-                    p4 = e[i][j]
-                    # s_(i-1)j + s_ij + e_ij <= 2
-                    cc.add_clause([-p1, -p3, -p4])
-                    # s_(i-1)j + s_ij + e_ij != 1
-                    cc.add_clause([-p1, p3, p4])
-                    cc.add_clause([p1, -p3, p4])
-                    cc.add_clause([p1, p3, -p4])
-                elif pat == Pattern.CENTER:  # パターン4: 中央
-                    p1 = s[i-1][j]
-                    p2 = e[i][j-1]
-                    p3 = s[i][j]
-                    p4 = e[i][j]
-                    # s_(i-1)j + e_i(j-1) + s_ij + e_ij <= 2
-                    cc.add_clause([-p1, -p2, -p3])
-                    cc.add_clause([-p1, -p2, -p4])
-                    cc.add_clause([-p1, -p3, -p4])
-                    cc.add_clause([-p2, -p3, -p4])
-                    # s_(i-1)j + e_i(j-1) + s_ij + e_ij != 1
-                    cc.add_clause([-p1, p2, p3, p4])
-                    cc.add_clause([p1, -p2, p3, p4])
-                    cc.add_clause([p1, p2, -p3, p4])
-                    cc.add_clause([p1, p2, p3, -p4])
-                elif pat == Pattern.TOP_RIGHT:  # パターン5: 右上
-                    p2 = e[i][j-1]
-                    p3 = s[i][j]
-                    # e_i(j-1) + s_ij <= 2は自動的に成立する
-                    # e_i(j-1) + s_ij != 1
-                    cc.add_clause([-p2, p3])
-                    cc.add_clause([p2, -p3])
-                elif pat == Pattern.BOTTOM_LEFT:  # パターン6: 左下
-                    p1 = s[i-1][j]
-                    p4 = e[i][j]
-                    # s_(i-1)j + e_ij <= 2は自動的に成立する
-                    # s_(i-1)j + e_ij != 1
-                    cc.add_clause([-p1, p4])
-                    cc.add_clause([p1, -p4])
-                elif pat == Pattern.RIGHT:  # パターン7: 右辺
-                    p1 = s[i-1][j]
-                    p2 = e[i][j-1]
-                    p3 = s[i][j]
-                    # s_(i-1)j + e_i(j-1) + s_ij <= 2
-                    cc.add_clause([-p1, -p2, -p3])
-                    # s_(i-1)j + e_i(j-1) + s_ij != 1
-                    cc.add_clause([-p1, p2, p3])
-                    cc.add_clause([p1, -p2, p3])
-                    cc.add_clause([p1, p2, -p3])
-                elif pat == Pattern.BOTTOM:  # パターン8: 下辺
-                    p1 = s[i-1][j]
-                    p2 = e[i][j-1]
-                    p4 = e[i][j]
-                    # s_(i-1)j + e_i(j-1) + e_ij <= 2
-                    cc.add_clause([-p1, -p2, -p4])
-                    # s_(i-1)j + e_i(j-1) + e_ij != 1
-                    cc.add_clause([-p1, p2, p4])
-                    cc.add_clause([p1, -p2, p4])
-                    cc.add_clause([p1, p2, -p4])
-                elif pat == Pattern.BOTTOM_RIGHT:  # パターン9: 右下
-                    p1 = s[i-1][j]
-                    p2 = e[i][j-1]
-                    # s_(i-1)j + e_i(j-1) <= 2は自動的に成立する
-                    # s_(i-1)j + e_i(j-1) != 1
-                    cc.add_clause([-p1, p2])
-                    cc.add_clause([p1, -p2])
-                else:
-                    raise RuntimeError('unreachable')
-            else:  # 数字マスの場合
-                if pat == Pattern.TOP_LEFT:  # パターン1: 左上
-                    p3 = s[i][j]
-                    p4 = e[i][j]
-                    # s_ij + e_ij >= 1
-                    cc.add_clause([p3, p4])
-                    # s_ij + e_ij <= 2
-                    cc.add_clause([-p3, -p4])
-                elif pat == Pattern.TOP:  # パターン2: 上辺
-                    p2 = e[i][j-1]
-                    p3 = s[i][j]
-                    p4 = e[i][j]
-                    # e_i(j-1) + s_ij + e_ij >= 1
-                    cc.add_clause([p2, p3, p4])
-                    # e_i(j-1) + s_ij + e_ij < 2
-                    cc.add_clause([-p2, -p3])
-                    cc.add_clause([-p2, -p4])
-                    cc.add_clause([-p3, -p4])
-                elif pat == Pattern.LEFT:  # パターン3: 左辺
-                    p1 = s[i-1][j]
-                    p3 = s[i][j]
-                    p4 = e[i][j]
-                    # s_(i-1)j + s_ij + e_ij >= 1
-                    cc.add_clause([p1, p3, p4])
-                    # s_(i-1)j + s_ij + e_ij < 2
-                    cc.add_clause([-p1, -p3])
-                    cc.add_clause([-p1, -p4])
-                    cc.add_clause([-p3, -p4])
-                elif pat == Pattern.CENTER:  # パターン4: 中央
-                    p1 = s[i-1][j]
-                    p2 = e[i][j-1]
-                    p3 = s[i][j]
-                    p4 = e[i][j]
-                    # s_(i-1)j + e_i(j-1) + s_ij + e_ij >= 1
-                    cc.add_clause([p1, p2, p3, p4])
-                    # s_(i-1)j + e_i(j-1) + s_ij + e_ij < 2
-                    cc.add_clause([-p1, -p2])
-                    cc.add_clause([-p1, -p3])
-                    cc.add_clause([-p1, -p4])
-                    cc.add_clause([-p2, -p3])
-                    cc.add_clause([-p2, -p4])
-                    cc.add_clause([-p3, -p4])
-                elif pat == Pattern.TOP_RIGHT:  # パターン5: 右上
-                    p2 = e[i][j-1]
-                    p3 = s[i][j]
-                    # e_i(j-1) + s_ij >= 1
-                    cc.add_clause([p2, p3])
-                    # e_i(j-1) + s_ij < 2
-                    cc.add_clause([-p2, -p3])
-                elif pat == Pattern.BOTTOM_LEFT:  # パターン6: 左下
-                    p1 = s[i-1][j]
-                    p4 = e[i][j]
-                    # s_(i-1)j + e_ij >= 1
-                    cc.add_clause([p1, p4])
-                    # s_(i-1)j + e_ij < 2
-                    cc.add_clause([-p1, -p4])
-                elif pat == Pattern.RIGHT:  # パターン7: 右辺
-                    p1 = s[i-1][j]
-                    p2 = e[i][j-1]
-                    p3 = s[i][j]
-                    # s_(i-1)j + e_i(j-1) + s_ij >= 1
-                    cc.add_clause([p1, p2, p3])
-                    # s_(i-1)j + e_i(j-1) + s_ij < 2
-                    cc.add_clause([-p1, -p2])
-                    cc.add_clause([-p1, -p3])
-                    cc.add_clause([-p2, -p3])
-                elif pat == Pattern.BOTTOM:  # パターン8: 下辺
-                    p1 = s[i-1][j]
-                    p2 = e[i][j-1]
-                    p4 = e[i][j]
-                    # s_(i-1)j + e_i(j-1) + e_ij >= 1
-                    cc.add_clause([p1, p2, p4])
-                    # s_(i-1)j + e_i(j-1) + e_ij < 2
-                    cc.add_clause([-p1, -p2])
-                    cc.add_clause([-p1, -p4])
-                    cc.add_clause([-p2, -p4])
-                elif pat == Pattern.BOTTOM_RIGHT:  # パターン9: 右下
-                    p1 = s[i-1][j]
-                    p2 = e[i][j-1]
-                    # s_(i-1)j + e_i(j-1) >= 1
-                    cc.add_clause([p1, p2])
-                    # s_(i-1)j + e_i(j-1) < 2
-                    cc.add_clause([-p1, -p2])
-
-    # s_ij = 1 -> x_ij = x_(i+1)j
-    for i in range(nl.rows-1):
-        for j in range(nl.cols):
-            for n in range(nl.num_lines):
-                # if (i, j) has down line, then (i, j) is connected to (i+1, j)
-                cc.add_clause([-s[i][j], -x[i][j][n], x[i+1][j][n]])
-                cc.add_clause([-s[i][j], x[i][j][n], -x[i+1][j][n]])
 
-    # e_ij = 1 -> x_ij = x_i(j+1)
-    for i in range(nl.rows):
-        for j in range(nl.cols-1):
-            for n in range(nl.num_lines):
-                # if (i, j) has right line, then (i, j) is connected to (i, j+1)
-                cc.add_clause([-e[i][j], -x[i][j][n], x[i][j+1][n]])
-                cc.add_clause([-e[i][j], x[i][j][n], -x[i][j+1][n]])
-
-    if Constraint.U_SHAPE in opts.constraint:
-        # 回り道を排除する
-        # 1: 2x2の場合
-        # 1.1:
-        # ┌───┬───┐
-        # │ ━━┿━┓ │
-        # ├───┼─╂─┤
-        # │ ━━┿━┛ │
-        # └───┴───┘
-        # 1.2:
-        # ┌───┬───┐
-        # │ ┏━┿━┓ │
-        # ├─╂─┼─╂─┤
-        # │ ┃ │ ┃ │
-        # └───┴───┘
-        # 1.3:
-        # ┌───┬───┐
-        # │ ┏━┿━━ │
-        # ├─╂─┼───┤
-        # │ ┗━┿━━ │
-        # └───┴───┘
-        # 1.4:
-        # ┌───┬───┐
-        # │ ┃ │ ┃ │
-        # ├─╂─┼─╂─┤
-        # │ ┗━┿━┛ │
-        # └───┴───┘
-        for i in range(nl.rows-1):
-            for j in range(nl.cols-1):
-                # 1
-                cc.add_clause([-e[i][j], -s[i][j+1], -e[i+1][j]])
-                # 2
-                cc.add_clause([-e[i][j], -s[i][j], -s[i][j+1]])
-                # 3
-                cc.add_clause([-e[i][j], -s[i][j], -e[i+1][j]])
-                # 4
-                cc.add_clause([-s[i][j], -s[i][j+1], -e[i+1][j]])
-
-    if Constraint.U_SHAPE_LONG in opts.constraint:
-        # 2: 3x2の場合
-        # 2.1:
-        # ┌───┬───┐
-        # │ ━━┿━┓ │
-        # ├───┼─╂─┤
-        # │ b │ ┃ │
-        # ├───┼─╂─┤
-        # │ ━━┿━┛ │
-        # └───┴───┘
-        # 2.2:
-        # ┌───┬───┐
-        # │ ┏━┿━━ │
-        # ├─╂─┼───┤
-        # │ ┃ │ b │
-        # ├─╂─┼───┤
-        # │ ┗━┿━━ │
-        # └───┴───┘
-        for i in range(nl.rows-2):
-            for j in range(nl.cols-1):
-                # 1
-                if nl.is_blank[i+1][j]:
-                    cc.add_clause(
-                        [-e[i][j], -s[i][j+1], -s[i+1][j+1], -e[i+2][j]])
-                # 2
-                if nl.is_blank[i+1][j+1]:
-                    cc.add_clause([-e[i][j], -s[i][j], -s[i+1][j], -e[i+2][j]])
-
-        # 3: 2x3の場合
-        # 3.1:
-        # ┌───┬───┬───┐
-        # │ ┏━┿━━━┿━┓ │
-        # ├─╂─┼───┼─╂─┤
-        # │ ┃ │ b │ ┃ │
-        # └───┴───┴───┘
-        # 3.2:
-        # ┌───┬───┬───┐
-        # │ ┃ │ b │ ┃ │
-        # ├─╂─┼───┼─╂─┤
-        # │ ┗━┿━━━┿━┛ │
-        # └───┴───┴───┘
-        for i in range(nl.rows-1):
-            for j in range(nl.cols-2):
-                # 1
-                if nl.is_blank[i+1][j+1]:
-                    cc.add_clause([-e[i][j], -s[i][j], -e[i][j+1], -s[i][j+2]])
-                # 2
-                if nl.is_blank[i][j+1]:
-                    cc.add_clause(
-                        [-s[i][j], -e[i+1][j], -e[i+1][j+1], -s[i][j+2]])
+    started = perf_counter()
+    # 大きな盤面では-jで、行の帯ごとに別プロセスで節を作る
+    add_clauses(cc, nl, x, opts.jobs or 1)
+    encode_elapsed = perf_counter() - started
 
     if opts.output is not None:
         with open(opts.output, 'w') as f:
             f.write(cc.to_dimacs())
 
     if not opts.show_only_elapsed_time:
-        print('Problem:')
-        nl.show()
-
-    solver = cc.to_solver()
-    is_satisfiable = solver.solve()
+        if opts.format == 'box':
+            print('Problem:')
+            nl.show()
+        if opts.show_size:
+            print(f'Size: {cc.num_literals} variables, '
+                  f'{cc.num_clauses} clauses')
+            workers = 'in process' if opts.jobs is None \
+                else f'{opts.jobs} workers'
+            print(f'Encode: {encode_elapsed:.3f}s ({workers})')
+
+    simplify_elapsed = 0.0
+    if opts.simplify:
+        # 解を数えるときは、ブロッキング節に使う変数を消去しない
+        frozen: list[Literal] = []
+        if opts.count is not None or opts.unique:
+            frozen = [l for row in s for l in row] \
+                + [l for row in e for l in row]
+        simp = cc.simplify(frozen=frozen)
+        simplify_elapsed = simp.elapsed
+        if not opts.show_only_elapsed_time and opts.show_size:
+            print(f'Simplify: {simp.num_clauses_before} -> '
+                  f'{simp.num_clauses} clauses, '
+                  f'{simp.num_literals_before} -> {simp.num_literals} '
+                  f'literals, {len(simp.fixed)} fixed, '
+                  f'{len(simp.eliminated)} eliminated '
+                  f'({simp.elapsed:.3f}s)')
+
+    solver = cc.to_solver(opts.solver)
+    if opts.phase:
+        num_routed = seed_phases(solver, nl, s, e, x)
+        if not opts.show_only_elapsed_time:
+            print(f'Phase: {num_routed}/{nl.num_lines} lines routed')
+    try:
+        if opts.count is not None or opts.unique:
+            count_answers(nl, cc, solver, s, e)
+            return
+        is_satisfiable = make_budget().solve(solver)
+    except NotImplementedError as err:
+        parser.error(f'{opts.solver}: {err}')
 
     if opts.show_only_elapsed_time:
-        print(solver.time())
+        print(solver.time_accum() + simplify_elapsed + search_elapsed)
+        if opts.show_size:
+            print(cc.num_literals, cc.num_clauses)
+        if opts.show_stats:
+            show_statistics(solver)
+        if is_satisfiable is None:
+            print('UNKNOWN')
+            sys.exit(EXIT_UNKNOWN)
+        if opts.verify is not None:
+            # 計測に含めないよう、時間を出力した後に検証する
+            if not is_satisfiable:
+                print('UNSAT')
+                return
+            model = cc.extend_model(cast(list[int], solver.get_model()))
+            answer_s, answer_e = decode_answer(nl, model, s, e)
+            result = verify_answer(nl, answer_s, answer_e)
+            print('VERIFIED' if result.ok else 'INVALID')
         return
 
+    if is_satisfiable is None:
+        show_status('UNKNOWN')
+        if opts.format == 'box' or opts.show_stats:
+            show_statistics(solver)
+        sys.exit(EXIT_UNKNOWN)
+
     if (not is_satisfiable):
-        print('UNSAT')
-        core = solver.get_core()
-        print(core)
+        show_status('UNSAT')
+        if opts.format == 'box':
+            core = solver.get_core()
+            print(core)
         return
 
-    model = cast(list[int], solver.get_model())
-    answer_s: Matrix[bool] = []
-    for i in range(nl.rows-1):
-        answer_s.append([])
-        for j in range(nl.cols):
-            answer_s[i].append(model[s[i][j].id-1] > 0)
-    answer_e: Matrix[bool] = []
-    for i in range(nl.rows):
-        answer_e.append([])
-        for j in range(nl.cols-1):
-            answer_e[i].append(model[e[i][j].id-1] > 0)
+    model = cc.extend_model(cast(list[int], solver.get_model()))
+    answer_s, answer_e = decode_answer(nl, model, s, e)
+    if opts.format == 'box':
+        print('Answer:')
+    show_answer(nl, answer_s, answer_e)
+    if opts.show_stats:
+        show_statistics(solver)
 
-    print('Answer:')
-    nl.show(with_answer=(answer_s, answer_e))
+    if opts.verify is not None:
+        show_verification(nl, answer_s, answer_e)
 
 
 if __name__ == '__main__':
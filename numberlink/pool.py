@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import perf_counter
+
+from cnf import Budget, CnfComposer, Literal
+from problem import Matrix, Numberlink, neighbor_masks
+from shard import Band, Layout, encode_band
+
+
+@dataclass(frozen=True, kw_only=True)
+class SizeClass:
+    # 節の構造は盤面の大きさ・線の数・回り道の窓だけで決まる
+    rows: int
+    cols: int
+    num_lines: int
+    window: int
+
+
+class Skeleton:
+    # 数字マスの位置を選択変数hにした、盤面によらない節を持つソルバ
+    # h_ijが真ならマス(i, j)は数字マス、偽なら空白マス
+    # 各盤面はhと数字マスのxを仮定として与えるだけで解く
+    def __init__(self, size: SizeClass, solver_name: str) -> None:
+        started = perf_counter()
+        self.size = size
+        cc = CnfComposer()
+        rows, cols, num_lines = size.rows, size.cols, size.num_lines
+
+        # 変数の割り当て順はmain.pyと同じ (s, e, xの順に行優先) にしておく
+        self.s: Matrix[Literal] = [
+            [cc.new_literal(name=f's_{i}{j}') for j in range(cols)]
+            for i in range(rows-1)]
+        self.e: Matrix[Literal] = [
+            [cc.new_literal(name=f'e_{i}{j}') for j in range(cols-1)]
+            for i in range(rows)]
+        self.x: Matrix[list[Literal]] = [
+            [[cc.new_literal(name=f'x_{i}{j}{n}') for n in range(num_lines)]
+             for j in range(cols)]
+            for i in range(rows)]
+        self.h: Matrix[Literal] = [
+            [cc.new_literal(name=f'h_{i}{j}') for j in range(cols)]
+            for i in range(rows)]
+
+        # 節はshard.pyの帯の符号化を、盤面全体を1つの帯として使って作る
+        layout = Layout(rows=rows, cols=cols, num_lines=num_lines,
+                        selectors=True)
+        assert cc.num_literals == layout.num_vars
+        neighbors = neighbor_masks(rows, cols)
+        band = Band(layout=layout, grid=None, neighbors=neighbors,
+                    window=size.window, rows=range(rows))
+        clauses = encode_band(band)
+        cc.add_raw_clauses(clauses, clauses.count(0))
+
+        self.num_vars = cc.num_literals
+        self.num_clauses = cc.num_clauses
+        self.solver = cc.to_solver(solver_name)
+        self.encode_elapsed = perf_counter() - started
+
+    def assumptions(self, nl: Numberlink) -> list[int]:
+        literals: list[int] = []
+        for i in range(nl.rows):
+            for j in range(nl.cols):
+                h = self.h[i][j].id
+                literals.append(h if nl.grid[i * nl.cols + j] else -h)
+        for hint in nl.hints:
+            literals.append(self.x[hint.row][hint.col][hint.n].id)
+        return literals
+
+    def solve(self, nl: Numberlink, budget: Budget) -> bool | None:
+        return budget.solve(self.solver, self.assumptions(nl))
+
+
+class SolverPool:
+    # 大きさの分類ごとのSkeletonを最大capacity個まで保持する
+    # 溢れたら最も長く使われていないものからソルバを解放する
+    def __init__(self, capacity: int, solver_name: str) -> None:
+        self.capacity = capacity
+        self.solver_name = solver_name
+        self.skeletons: OrderedDict[SizeClass, Skeleton] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, nl: Numberlink, window: int) -> tuple[Skeleton, bool]:
+        # 2つ目の値は、既存のSkeletonを使い回したかどうか
+        size = SizeClass(rows=nl.rows, cols=nl.cols, num_lines=nl.num_lines,
+                         window=window)
+        skeleton = self.skeletons.get(size)
+        if skeleton is not None:
+            self.skeletons.move_to_end(size)
+            self.hits += 1
+            return skeleton, True
+
+        self.misses += 1
+        while self.skeletons and len(self.skeletons) >= self.capacity:
+            _, evicted = self.skeletons.popitem(last=False)
+            evicted.solver.delete()
+            self.evictions += 1
+        skeleton = Skeleton(size, self.solver_name)
+        self.skeletons[size] = skeleton
+        return skeleton, False
+
+    def close(self):
+        for skeleton in self.skeletons.values():
+            skeleton.solver.delete()
+        self.skeletons.clear()
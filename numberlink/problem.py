@@ -0,0 +1,197 @@
+from array import array
+from dataclasses import dataclass
+from functools import cache
+import sys
+from typing import Iterable, Iterator, TextIO, TypeVar
+
+T = TypeVar('T')
+Matrix = list[list[T]]
+
+# マスから盤面の内側へ辺が出せる方向 (Numberlink.neighborsのビット)
+UP = 1
+LEFT = 2
+DOWN = 4
+RIGHT = 8
+
+
+@dataclass(frozen=True, kw_only=True, slots=True)
+class Hint:
+    n: int
+    row: int
+    col: int
+
+
+@cache
+def neighbor_masks(rows: int, cols: int) -> bytes:
+    # 各マスから辺を出せる方向を行優先で並べたもの
+    # 盤面の大きさだけで決まるので、同じ大きさの問題で使い回す
+    neighbors = bytearray(rows * cols)
+    for i in range(rows):
+        for j in range(cols):
+            neighbors[i * cols + j] = (UP if i > 0 else 0) \
+                | (LEFT if j > 0 else 0) \
+                | (DOWN if i < rows-1 else 0) \
+                | (RIGHT if j < cols-1 else 0)
+    return bytes(neighbors)
+
+
+def _cell_glyph(north: bool, south: bool, east: bool, west: bool) -> str:
+    if north and south:
+        return ' ┃ '
+    elif east and west:
+        return '━━━'
+    elif north and east:
+        return ' ┗━'
+    elif north and west:
+        return '━┛ '
+    elif south and east:
+        return ' ┏━'
+    elif south and west:
+        return '━┓ '
+    return '   '
+
+
+# 空白マスの描画 (北 | 南<<1 | 東<<2 | 西<<3 で引く)
+_CELL_GLYPHS = tuple(
+    _cell_glyph(bool(m & 1), bool(m & 2), bool(m & 4), bool(m & 8))
+    for m in range(16))
+
+
+@dataclass(frozen=True, kw_only=True)
+class Numberlink:
+    name = 'numberlink'
+    rows: int
+    cols: int
+    num_lines: int
+    hints: tuple[Hint, ...]
+    # 以下は行優先 (マス(i, j)はi*cols+j番目) の配列
+    # 各マスの数字 (0は空白マス, 数字マスは線の番号+1)
+    grid: array
+    # 各マスから辺を出せる方向 (UP | LEFT | DOWN | RIGHT)
+    neighbors: bytes
+
+    def show(self, *, with_answer: tuple[Matrix[bool], Matrix[bool]] | None = None):
+        self.render(sys.stdout, with_answer=with_answer)
+
+    def render(
+            self,
+            out: TextIO,
+            *,
+            with_answer: tuple[Matrix[bool], Matrix[bool]] | None = None):
+        # 盤面全体を1つの文字列に連結していかず、1行ずつ組み立てて書き出す
+        answer_s: Matrix[bool] | None = None
+        answer_e: Matrix[bool] | None = None
+        if with_answer is not None:
+            answer_s, answer_e = with_answer
+        no_edges = [False] * self.cols
+
+        out.write('┌' + '───┬' * (self.cols-1) + '───┐\n')
+        for i in range(self.rows):
+            north_row = answer_s[i-1] \
+                if answer_s is not None and i != 0 else no_edges
+            south_row = answer_s[i] \
+                if answer_s is not None and i != self.rows-1 else no_edges
+            east_row = answer_e[i] if answer_e is not None else no_edges
+
+            line = ['│']
+            for j in range(self.cols):
+                east = j != self.cols-1 and east_row[j]
+                west = j != 0 and east_row[j-1]
+                n = self.grid[i * self.cols + j]
+                if n:
+                    line.append(f'{n:^3}')
+                else:
+                    line.append(_CELL_GLYPHS[
+                        north_row[j] | south_row[j] << 1
+                        | east << 2 | west << 3])
+                line.append('┿' if east else '│')
+            line.append('\n')
+            out.write(''.join(line))
+
+            if i == self.rows-1:
+                continue
+            line = ['├']
+            for j in range(self.cols):
+                line.append('─╂─' if south_row[j] else '───')
+                line.append('┤' if j == self.cols-1 else '┼')
+            line.append('\n')
+            out.write(''.join(line))
+
+        out.write('└' + '───┴' * (self.cols-1) + '───┘\n')
+
+
+def _parse_cell(text: str) -> tuple[int, int]:
+    # (8,1) -> (row, col) = (1, 8)
+    col, row = text.strip('()').split(',')
+    return int(row), int(col)
+
+
+def _make_problem(
+        rows: int,
+        cols: int,
+        num_lines: int,
+        hints: list[Hint]) -> Numberlink:
+    grid = array('H', bytes(2 * rows * cols))
+    for h in hints:
+        grid[h.row * cols + h.col] = h.n + 1
+    neighbors = neighbor_masks(rows, cols)
+    return Numberlink(
+        rows=rows,
+        cols=cols,
+        num_lines=num_lines,
+        hints=tuple(hints),
+        grid=grid,
+        neighbors=neighbors,
+    )
+
+
+def parse_problems(lines: Iterable[str]) -> Iterator[Numberlink]:
+    # ADC形式の問題を1行ずつ読み、SIZEの行ごとに新しい問題として返す
+    # 1つのファイルに複数の問題が続けて書かれていてもよい
+    rows = 0
+    cols = 0
+    num_lines = 0
+    hints: list[Hint] | None = None
+    for line in lines:
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            # if line is empty or comment, skip
+            continue
+
+        key, _, value = line.partition(' ')
+        if key == 'SIZE':
+            if hints is not None:
+                yield _make_problem(rows, cols, num_lines, hints)
+            # SIZE 10X10
+            cols, rows = map(int, value.upper().split('X'))
+            num_lines = 0
+            hints = []
+        elif hints is None:
+            raise ValueError(f'expected SIZE before: {line}')
+        elif key == 'LINE_NUM':
+            # LINE_NUM 7
+            num_lines = int(value)
+        else:
+            # LINE#1 (8,1)-(8,8)
+            n = int(key.partition('#')[2]) - 1
+            p1, _, p2 = value.replace(' ', '').partition('-')
+            p1_row, p1_col = _parse_cell(p1)
+            p2_row, p2_col = _parse_cell(p2)
+            hints.append(Hint(n=n, row=p1_row, col=p1_col))
+            hints.append(Hint(n=n, row=p2_row, col=p2_col))
+    if hints is not None:
+        yield _make_problem(rows, cols, num_lines, hints)
+
+
+def load_problems(filename: str) -> list[Numberlink]:
+    with open(filename) as f:
+        return list(parse_problems(f))
+
+
+def load_problem(filename: str, index: int = 0) -> Numberlink:
+    # 複数の問題を含むファイルでは、index番目 (0-indexed) の問題を返す
+    with open(filename) as f:
+        for k, nl in enumerate(parse_problems(f)):
+            if k == index:
+                return nl
+    raise ValueError(f'{filename} has no problem #{index + 1}')
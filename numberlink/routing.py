@@ -0,0 +1,59 @@
+from collections import deque
+
+from problem import Hint, Numberlink
+
+Cell = tuple[int, int]
+
+
+def _bfs(nl: Numberlink, start: Cell, goal: Cell,
+         blocked: bytearray) -> list[Cell] | None:
+    # blockedなマスを避けたstartからgoalへの最短経路 (両端を含む)
+    prev: dict[Cell, Cell | None] = {start: None}
+    queue = deque([start])
+    while queue:
+        cur = queue.popleft()
+        if cur == goal:
+            path = [cur]
+            while (p := prev[path[-1]]) is not None:
+                path.append(p)
+            return path[::-1]
+        i, j = cur
+        for n in ((i-1, j), (i, j-1), (i+1, j), (i, j+1)):
+            if not (0 <= n[0] < nl.rows and 0 <= n[1] < nl.cols):
+                continue
+            if n in prev or (n != goal and blocked[n[0] * nl.cols + n[1]]):
+                continue
+            prev[n] = cur
+            queue.append(n)
+    return None
+
+
+def route_greedily(nl: Numberlink) -> dict[int, list[Cell]]:
+    # 端点間のマンハッタン距離が短い線から順に、BFSの最短経路で線を引く
+    # 既に引いた線を避けられなければ、他の線と重なることを許して引く
+    # (ソルバに与える初期値なので、矛盾があっても構わない)
+    ends: dict[int, list[Hint]] = {}
+    for h in nl.hints:
+        ends.setdefault(h.n, []).append(h)
+
+    def distance(n: int) -> int:
+        a, b = ends[n]
+        return abs(a.row - b.row) + abs(a.col - b.col)
+
+    # 数字マスは常に通れない
+    is_hint = bytearray(v != 0 for v in nl.grid)
+    used = bytearray(is_hint)
+    routes: dict[int, list[Cell]] = {}
+    for n in sorted(ends, key=distance):
+        if len(ends[n]) != 2:
+            continue
+        a, b = ends[n]
+        start = (a.row, a.col)
+        goal = (b.row, b.col)
+        path = _bfs(nl, start, goal, used) or _bfs(nl, start, goal, is_hint)
+        if path is None:
+            continue
+        for i, j in path:
+            used[i * nl.cols + j] = True
+        routes[n] = path
+    return routes
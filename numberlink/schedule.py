@@ -0,0 +1,80 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from heapq import heappop, heappush
+from statistics import median
+from time import perf_counter
+from typing import Any, Callable, Hashable, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+R = TypeVar('R')
+
+
+def predict(
+        sizes: dict[K, float],
+        history: dict[K, float]) -> tuple[dict[K, float], bool]:
+    # 前回の結果があればその時間を、なければ大きさに比例するとして見積もる
+    # 比例定数は、結果と大きさの両方がわかっているジョブの比の中央値
+    # 2つ目の値は、見積もりが秒単位かどうか (結果が1つもなければ大きさのまま)
+    ratios = [history[k] / size for k, size in sizes.items()
+              if k in history and size > 0]
+    scale = median(ratios) if ratios else None
+    predictions: dict[K, float] = {}
+    for k, size in sizes.items():
+        if k in history:
+            predictions[k] = history[k]
+        elif scale is not None:
+            predictions[k] = scale * size
+        else:
+            predictions[k] = size
+    calibrated = scale is not None or all(k in history for k in sizes)
+    return predictions, calibrated
+
+
+def longest_first(predictions: dict[K, float]) -> list[K]:
+    # 見積もりが同じなら元の順を保つ
+    return sorted(predictions, key=lambda k: -predictions[k])
+
+
+def makespan(durations: list[float], workers: int) -> float:
+    # この順に、最初に空いたワーカーへ割り当てたときの全体の所要時間
+    finish = [0.0] * max(workers, 1)
+    for d in durations:
+        heappush(finish, heappop(finish) + d)
+    return max(finish)
+
+
+def run_in_order(
+        fn: Callable[..., R],
+        jobs: list[tuple[Any, ...]],
+        workers: int,
+        done: Callable[[tuple[Any, ...], R], None]) -> float:
+    # jobsをこの順にプールへ積み、空いたワーカーから次のジョブを取らせる
+    # 終わったものから順にdoneを呼び、全体の経過時間を返す
+    started = perf_counter()
+    if workers <= 1:
+        for args in jobs:
+            done(args, fn(*args))
+        return perf_counter() - started
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fn, *args): args for args in jobs}
+        for future in as_completed(futures):
+            done(futures[future], future.result())
+    return perf_counter() - started
+
+
+def report_makespan(
+        order: list[K],
+        predictions: dict[K, float],
+        calibrated: bool,
+        workers: int,
+        actual: float):
+    # 見積もりの通りに進んだ場合の所要時間と、実際の所要時間を比べる
+    print(f'Schedule: {len(order)} jobs on {workers} workers, '
+          'longest predicted first')
+    if not calibrated:
+        print(f'Makespan: actual {actual:.3f}s '
+              '(no earlier results; ordered by size only)')
+        return
+    predicted = makespan([predictions[k] for k in order], workers)
+    in_order = makespan([predictions[k] for k in predictions], workers)
+    print(f'Makespan: predicted {predicted:.3f}s '
+          f'(input order {in_order:.3f}s), actual {actual:.3f}s')
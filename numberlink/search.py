@@ -0,0 +1,212 @@
+from array import array
+from dataclasses import dataclass
+from heapq import heappop, heappush
+from random import Random
+from time import perf_counter
+
+from problem import DOWN, LEFT, RIGHT, UP, Matrix, Numberlink
+
+# 混雑のコスト (PathFinderの負の交渉に倣う)
+# 他の線と重なるマスは present * 重なりの数 だけ高くなり、
+# 重なりが解けないマスには履歴のコストが積み上がっていく
+PRESENT_START = 0.5
+PRESENT_GROWTH = 1.5
+# 上限がないと、長く続けたときに浮動小数点数が溢れる
+PRESENT_MAX = 1e6
+HISTORY_STEP = 1.0
+
+
+@dataclass(frozen=True, kw_only=True)
+class SearchResult:
+    # 見つからなければanswerはNone
+    answer: tuple[Matrix[bool], Matrix[bool]] | None
+    elapsed: float
+    # 線を引き直した回数
+    reroutes: int
+    # 打ち切った時点で複数の線が通っているマスの数
+    conflicts: int
+    # 空白を埋めるために押し広げた辺の数
+    bulges: int
+
+
+class PathSearch:
+    # 線ごとに端点間の経路を1本ずつ持ち、重なりを許して引いておく
+    # 重なったマスを通る線を引き剥がし、混雑を避ける経路に引き直すことを
+    # 重なりがなくなるまで繰り返す
+    def __init__(self, nl: Numberlink, seed: int = 0) -> None:
+        self.nl = nl
+        self.rng = Random(seed)
+        size = nl.rows * nl.cols
+        self.adjacent: list[tuple[int, ...]] = []
+        for k in range(size):
+            mask = nl.neighbors[k]
+            cells: list[int] = []
+            if mask & UP:
+                cells.append(k - nl.cols)
+            if mask & LEFT:
+                cells.append(k - 1)
+            if mask & DOWN:
+                cells.append(k + nl.cols)
+            if mask & RIGHT:
+                cells.append(k + 1)
+            self.adjacent.append(tuple(cells))
+
+        self.ends: dict[int, list[int]] = {}
+        for h in nl.hints:
+            self.ends.setdefault(h.n, []).append(h.row * nl.cols + h.col)
+        # 各マスを通る線の数と、引き直しで積み上がったコスト
+        self.usage = array('i', bytes(4 * size))
+        self.history = array('d', bytes(8 * size))
+        self.present = PRESENT_START
+        self.paths: dict[int, list[int]] = {}
+        self.reroutes = 0
+        self.bulges = 0
+
+    def _cost(self, k: int) -> float:
+        return (1.0 + self.history[k]) * (1.0 + self.present * self.usage[k])
+
+    def _route(self, n: int) -> list[int] | None:
+        # 混雑のコストを重みにした最短経路 (両端を含む)
+        # 他の線の数字マスは通れない
+        start, goal = self.ends[n]
+        grid = self.nl.grid
+        dist = {start: 0.0}
+        prev: dict[int, int] = {}
+        queue = [(0.0, start)]
+        while queue:
+            d, cur = heappop(queue)
+            if cur == goal:
+                path = [goal]
+                while path[-1] != start:
+                    path.append(prev[path[-1]])
+                return path[::-1]
+            if d > dist[cur]:
+                continue
+            for k in self.adjacent[cur]:
+                if grid[k] and k != goal:
+                    continue
+                nd = d + self._cost(k)
+                if nd < dist.get(k, float('inf')):
+                    dist[k] = nd
+                    prev[k] = cur
+                    heappush(queue, (nd, k))
+        return None
+
+    def _place(self, n: int, path: list[int]):
+        self.paths[n] = path
+        for k in path:
+            self.usage[k] += 1
+
+    def _rip_up(self, n: int):
+        for k in self.paths.pop(n):
+            self.usage[k] -= 1
+
+    def conflicting(self) -> list[int]:
+        return [k for k, u in enumerate(self.usage) if u > 1]
+
+    def run(self, deadline: float) -> bool:
+        # 端点間が近い線から引く
+        cols = self.nl.cols
+
+        def distance(n: int) -> int:
+            a, b = self.ends[n]
+            return abs(a // cols - b // cols) + abs(a % cols - b % cols)
+
+        if any(len(ends) != 2 for ends in self.ends.values()):
+            return False
+        for n in sorted(self.ends, key=distance):
+            path = self._route(n)
+            if path is None:
+                return False
+            self._place(n, path)
+
+        while perf_counter() < deadline:
+            conflicts = self.conflicting()
+            if not conflicts:
+                return True
+            congested = set(conflicts)
+            victims = [n for n, path in self.paths.items()
+                       if not congested.isdisjoint(path)]
+            self.rng.shuffle(victims)
+            for n in victims:
+                if perf_counter() >= deadline:
+                    break
+                self._rip_up(n)
+                path = self._route(n)
+                assert path is not None
+                self._place(n, path)
+                self.reroutes += 1
+            for k in self.conflicting():
+                self.history[k] += HISTORY_STEP
+            self.present = min(self.present * PRESENT_GROWTH, PRESENT_MAX)
+        return not self.conflicting()
+
+    def fill(self):
+        # 線の辺(u, v)の横に並んだ2つの空きマス(u', v')があれば、
+        # u -> u' -> v' -> v と押し広げて空白マスを減らす
+        # 押し広げるたびに空きマスが2つ減るので、必ず止まる
+        cols = self.nl.cols
+        free = bytearray(self.usage[k] == 0 and self.nl.grid[k] == 0
+                         for k in range(len(self.usage)))
+        changed = True
+        while changed:
+            changed = False
+            for n, path in self.paths.items():
+                widened = [path[0]]
+                for v in path[1:]:
+                    u = widened[-1]
+                    # 横の辺なら上下、縦の辺なら左右にずらす
+                    # (1列の盤面では縦の辺も番号の差が1なので、行で比べる)
+                    side = cols if u // cols == v // cols else 1
+                    for offset in (side, -side):
+                        a, b = u + offset, v + offset
+                        if a not in self.adjacent[u] \
+                                or b not in self.adjacent[v]:
+                            continue
+                        if free[a] and free[b]:
+                            widened.extend((a, b))
+                            free[a] = free[b] = False
+                            self.usage[a] += 1
+                            self.usage[b] += 1
+                            self.bulges += 1
+                            changed = True
+                            break
+                    widened.append(v)
+                self.paths[n] = widened
+
+    def answer(self) -> tuple[Matrix[bool], Matrix[bool]]:
+        # 経路の隣り合うマスの間に辺を引く (main.pyのs, eと同じ形)
+        rows, cols = self.nl.rows, self.nl.cols
+        answer_s = [[False] * cols for _ in range(rows-1)]
+        answer_e = [[False] * (cols-1) for _ in range(rows)]
+        for path in self.paths.values():
+            for a, b in zip(path, path[1:]):
+                a, b = min(a, b), max(a, b)
+                if a // cols == b // cols:
+                    answer_e[a // cols][a % cols] = True
+                else:
+                    answer_s[a // cols][a % cols] = True
+        return answer_s, answer_e
+
+
+def search_paths(
+        nl: Numberlink,
+        time_limit: float,
+        *,
+        fill: bool = True,
+        seed: int = 0) -> SearchResult:
+    started = perf_counter()
+    search = PathSearch(nl, seed)
+    found = search.run(started + time_limit)
+    answer = None
+    if found:
+        if fill:
+            search.fill()
+        answer = search.answer()
+    return SearchResult(
+        answer=answer,
+        elapsed=perf_counter() - started,
+        reroutes=search.reroutes,
+        conflicts=len(search.conflicting()),
+        bulges=search.bulges,
+    )
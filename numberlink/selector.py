@@ -0,0 +1,126 @@
+from dataclasses import dataclass
+import json
+from math import log2, sqrt
+
+from problem import Numberlink
+
+# 特徴量の名前 (features()の返す順)
+FEATURES = ('log2_rows', 'log2_cols', 'log2_lines', 'hint_density')
+
+
+@dataclass(frozen=True, kw_only=True)
+class Config:
+    # -cで与える窓の大きさ (空なら回り道の制約なし) とソルバ
+    constraint: tuple[int, ...]
+    solver: str
+
+    @property
+    def args(self) -> str:
+        if not self.constraint:
+            return f'--solver {self.solver}'
+        windows = ' '.join(map(str, self.constraint))
+        return f'-c {windows} --solver {self.solver}'
+
+
+@dataclass(frozen=True, kw_only=True)
+class Instance:
+    # 学習に使った問題1つ分
+    # timesはconfigsと同じ順で、制限時間内に解けなければNone
+    problem: str
+    features: tuple[float, ...]
+    times: tuple[float | None, ...]
+
+
+def features(nl: Numberlink) -> tuple[float, ...]:
+    # 大きさは桁が違うので対数を取る
+    # 数字マスの密度 = 数字マスの数 / マスの数
+    return (
+        log2(nl.rows),
+        log2(nl.cols),
+        log2(max(nl.num_lines, 1)),
+        len(nl.hints) / (nl.rows * nl.cols),
+    )
+
+
+@dataclass(frozen=True, kw_only=True)
+class Selector:
+    # 特徴量の近いneighbors個の学習問題で、合計の実行時間が最も短い設定を選ぶ
+    # 解けなかった実行は制限時間の2倍 (PAR-2と同じ) として数える
+    configs: tuple[Config, ...]
+    instances: tuple[Instance, ...]
+    timeout: float
+    neighbors: int = 3
+
+    def _scales(self) -> list[float]:
+        # 特徴量ごとの標準偏差 (全て同じ値なら1)
+        scales: list[float] = []
+        for k in range(len(FEATURES)):
+            values = [i.features[k] for i in self.instances]
+            mean = sum(values) / len(values)
+            var = sum((v - mean) ** 2 for v in values) / len(values)
+            scales.append(sqrt(var) or 1.0)
+        return scales
+
+    def nearest(self, point: tuple[float, ...]) -> list[Instance]:
+        scales = self._scales()
+
+        def distance(i: Instance) -> float:
+            return sqrt(sum(((a - b) / s) ** 2
+                            for a, b, s in zip(i.features, point, scales)))
+
+        return sorted(self.instances, key=distance)[:self.neighbors]
+
+    def penalized(self, instance: Instance, index: int) -> float:
+        t = instance.times[index]
+        return 2 * self.timeout if t is None else t
+
+    def best(self, point: tuple[float, ...]) -> int:
+        # 選んだ設定のconfigsでの番号
+        # 近い問題で差がつかなければ (全て解けなかったなど)、全体の合計で選ぶ
+        near = self.nearest(point)
+        return min(range(len(self.configs)),
+                   key=lambda k: (sum(self.penalized(i, k) for i in near),
+                                  sum(self.penalized(i, k)
+                                      for i in self.instances)))
+
+    def choose(self, nl: Numberlink) -> tuple[Config, list[Instance]]:
+        # 選んだ設定と、その根拠になった学習問題を返す
+        point = features(nl)
+        return self.configs[self.best(point)], self.nearest(point)
+
+
+def save_selector(selector: Selector, path: str):
+    data = {
+        'features': list(FEATURES),
+        'timeout': selector.timeout,
+        'neighbors': selector.neighbors,
+        'configs': [{'constraint': list(c.constraint), 'solver': c.solver}
+                    for c in selector.configs],
+        'instances': [{'problem': i.problem,
+                       'features': list(i.features),
+                       'times': list(i.times)}
+                      for i in selector.instances],
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def load_selector(path: str) -> Selector:
+    with open(path) as f:
+        data = json.load(f)
+    if tuple(data['features']) != FEATURES:
+        raise ValueError(f'{path}: features {data["features"]} do not match '
+                         f'{list(FEATURES)}; rerun numberlink/tune.py')
+    if not data['instances']:
+        raise ValueError(f'{path}: no training instances')
+    return Selector(
+        configs=tuple(Config(constraint=tuple(c['constraint']),
+                             solver=c['solver'])
+                      for c in data['configs']),
+        instances=tuple(Instance(problem=i['problem'],
+                                 features=tuple(i['features']),
+                                 times=tuple(i['times']))
+                        for i in data['instances']),
+        timeout=data['timeout'],
+        neighbors=data['neighbors'],
+    )
@@ -0,0 +1,195 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import combinations
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from detour import Cell, detour_clauses, skeleton_detour_clauses
+from problem import DOWN, LEFT, RIGHT, UP, Numberlink
+
+
+@dataclass(frozen=True, kw_only=True)
+class Layout:
+    # 変数番号の割り当て
+    # main.pyでの割り当て順 (s, e, xの順に行優先) と一致させること
+    # selectorsなら、その後に数字マスかどうかの選択変数h (pool.pyのSkeleton) を置く
+    rows: int
+    cols: int
+    num_lines: int
+    selectors: bool = False
+
+    def s(self, i: int, j: int) -> int:
+        return i * self.cols + j + 1
+
+    def e(self, i: int, j: int) -> int:
+        return (self.rows-1) * self.cols + i * (self.cols-1) + j + 1
+
+    def x(self, i: int, j: int, n: int) -> int:
+        base = (self.rows-1) * self.cols + self.rows * (self.cols-1)
+        return base + (i * self.cols + j) * self.num_lines + n + 1
+
+    def h(self, i: int, j: int) -> int:
+        base = self.x(self.rows-1, self.cols-1, self.num_lines-1)
+        return base + i * self.cols + j + 1
+
+    @property
+    def num_vars(self) -> int:
+        if self.selectors:
+            return self.h(self.rows-1, self.cols-1)
+        return self.x(self.rows-1, self.cols-1, self.num_lines-1)
+
+
+@dataclass(frozen=True, kw_only=True)
+class Band:
+    # 上端の行がrowsに含まれる節を作る
+    # (セル単位の節はそのセルの行、下向きの辺や窓の節は上端の行に属する)
+    # layout.selectorsなら節は盤面によらないので、gridはNone
+    layout: Layout
+    grid: array | None
+    neighbors: bytes
+    window: int
+    rows: range
+
+
+def _edge(layout: Layout, a: Cell, b: Cell) -> int:
+    if a[0] == b[0]:
+        return layout.e(a[0], min(a[1], b[1]))
+    return layout.s(min(a[0], b[0]), a[1])
+
+
+def encode_band(band: Band) -> array:
+    # 帯の節を0区切り(DIMACSと同じ)で並べた整数列を返す
+    # 数字マスの単位節は含まない
+    layout = band.layout
+    rows, cols, num_lines = layout.rows, layout.cols, layout.num_lines
+    buf = array('i')
+
+    def add(clause: list[int]):
+        buf.extend(clause)
+        buf.append(0)
+
+    for i in band.rows:
+        for j in range(cols):
+            # x_ijnは高々1つが真
+            for a, b in combinations(range(num_lines), 2):
+                add([-layout.x(i, j, a), -layout.x(i, j, b)])
+
+            # 上, 左, 下, 右の辺のうち盤面の内側にあるもの
+            k = i * cols + j
+            mask = band.neighbors[k]
+            edges: list[int] = []
+            if mask & UP:
+                edges.append(layout.s(i-1, j))
+            if mask & LEFT:
+                edges.append(layout.e(i, j-1))
+            if mask & DOWN:
+                edges.append(layout.s(i, j))
+            if mask & RIGHT:
+                edges.append(layout.e(i, j))
+            # 選択変数があれば両方の節を作り、空白マスの節はh_ijが真なら、
+            # 数字マスの節はh_ijが偽なら成り立つようにする
+            if layout.selectors:
+                h = layout.h(i, j)
+                as_blank: list[int] | None = [h]
+                as_hint: list[int] | None = [-h]
+            elif band.grid is not None and band.grid[k] == 0:
+                as_blank, as_hint = [], None
+            else:
+                as_blank, as_hint = None, []
+            if as_blank is not None:
+                # 空白マスから線が2本出るか、1本も出ない
+                for c in combinations(edges, 3):
+                    add([-p for p in c] + as_blank)
+                for p in edges:
+                    add([-q if q == p else q for q in edges] + as_blank)
+            if as_hint is not None:
+                # 数字マスから線が1本だけ出る
+                add(edges + as_hint)
+                for p, q in combinations(edges, 2):
+                    add([-p, -q] + as_hint)
+
+        # s_ij = 1 -> x_ij = x_(i+1)j
+        if i < rows-1:
+            for j in range(cols):
+                s = layout.s(i, j)
+                for n in range(num_lines):
+                    add([-s, -layout.x(i, j, n), layout.x(i+1, j, n)])
+                    add([-s, layout.x(i, j, n), -layout.x(i+1, j, n)])
+
+        # e_ij = 1 -> x_ij = x_i(j+1)
+        for j in range(cols-1):
+            e = layout.e(i, j)
+            for n in range(num_lines):
+                add([-e, -layout.x(i, j, n), layout.x(i, j+1, n)])
+                add([-e, layout.x(i, j, n), -layout.x(i, j+1, n)])
+
+    if band.window < 2:
+        return buf
+    if layout.selectors:
+        # 回り道の節は、通るマスのどれかが数字マスなら無効にする
+        for clause, blanks in skeleton_detour_clauses(
+                rows, cols, band.window, band.rows):
+            add([_edge(layout, a, b) if positive else -_edge(layout, a, b)
+                 for (a, b), positive in clause]
+                + [layout.h(r, c) for r, c in blanks])
+    else:
+        assert band.grid is not None
+        for clause in detour_clauses(
+                band.grid, rows, cols, band.window, band.rows):
+            add([_edge(layout, a, b) if positive else -_edge(layout, a, b)
+                 for (a, b), positive in clause])
+    return buf
+
+
+def _encode_to_shared(band: Band) -> tuple[str, int]:
+    # ワーカー側: 節を共有メモリに書き出し、その名前と長さを返す
+    # 共有メモリの解放は親プロセスが行う
+    buf = encode_band(band)
+    nbytes = len(buf) * buf.itemsize
+    shm = SharedMemory(create=True, size=max(nbytes, 1))
+    with memoryview(buf).cast('B') as src:
+        shm.buf[:nbytes] = src
+    shm.close()
+    return shm.name, len(buf)
+
+
+def split_rows(rows: int, num_bands: int) -> list[range]:
+    # 行を連続した帯に分ける (各行はちょうど1つの帯に属する)
+    num_bands = max(1, min(num_bands, rows))
+    bounds = [rows * k // num_bands for k in range(num_bands + 1)]
+    return [range(a, b) for a, b in zip(bounds, bounds[1:])]
+
+
+def encode_sharded(
+        nl: Numberlink,
+        window: int,
+        jobs: int) -> tuple[array, int]:
+    # 盤面を行の帯に分け、帯ごとの節をjobs個のプロセスで並列に作る
+    # 結果は帯の順に連結した0区切りの整数列と、節の数
+    layout = Layout(rows=nl.rows, cols=nl.cols, num_lines=nl.num_lines)
+    bands = [Band(layout=layout, grid=nl.grid, neighbors=nl.neighbors,
+                  window=window, rows=rows)
+             for rows in split_rows(nl.rows, jobs)]
+
+    if jobs <= 1:
+        clauses = array('i')
+        for band in bands:
+            clauses.extend(encode_band(band))
+        return clauses, clauses.count(0)
+
+    # ワーカーが作った共有メモリを親と同じトラッカーに登録させる
+    # (ワーカーごとにトラッカーが立つと、終了時に解放済みの共有メモリを警告する)
+    resource_tracker.ensure_running()
+    clauses = array('i')
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for name, length in executor.map(_encode_to_shared, bands):
+            # 共有メモリからそのまま連結し、読み終えたらすぐに解放する
+            shm = SharedMemory(name=name)
+            try:
+                with shm.buf[:length * clauses.itemsize] as view:
+                    clauses.frombytes(view)
+            finally:
+                shm.close()
+                shm.unlink()
+    return clauses, clauses.count(0)
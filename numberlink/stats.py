@@ -0,0 +1,46 @@
+from random import Random
+from statistics import median
+from typing import Callable
+
+
+def bootstrap_ci(
+        samples: list[float],
+        *,
+        statistic: Callable[[list[float]], float] = median,
+        confidence: float = 0.95,
+        rounds: int = 2000,
+        seed: int = 0) -> tuple[float, float]:
+    # 復元抽出を繰り返して統計量の信頼区間を求める (パーセンタイル法)
+    rng = Random(seed)
+    n = len(samples)
+    estimates = sorted(
+        statistic([samples[rng.randrange(n)] for _ in range(n)])
+        for _ in range(rounds))
+    alpha = (1 - confidence) / 2
+    lo = estimates[int(alpha * (rounds - 1))]
+    hi = estimates[int((1 - alpha) * (rounds - 1))]
+    return lo, hi
+
+
+def bootstrap_ratio_ci(
+        current: list[float],
+        baseline: list[float],
+        *,
+        confidence: float = 0.95,
+        rounds: int = 2000,
+        seed: int = 0) -> tuple[float, float]:
+    # median(current) / median(baseline) の信頼区間
+    # 2つの標本をそれぞれ独立に復元抽出する
+    rng = Random(seed)
+    n = len(current)
+    m = len(baseline)
+    ratios: list[float] = []
+    for _ in range(rounds):
+        cur = median([current[rng.randrange(n)] for _ in range(n)])
+        base = median([baseline[rng.randrange(m)] for _ in range(m)])
+        ratios.append(cur / base if base > 0 else float('inf'))
+    ratios.sort()
+    alpha = (1 - confidence) / 2
+    lo = ratios[int(alpha * (rounds - 1))]
+    hi = ratios[int((1 - alpha) * (rounds - 1))]
+    return lo, hi
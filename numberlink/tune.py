@@ -0,0 +1,158 @@
+from argparse import ArgumentParser
+from glob import glob
+from statistics import median
+import subprocess
+from sys import executable
+from time import perf_counter
+
+from problem import load_problem
+from selector import Config, Instance, Selector, features, save_selector
+
+
+def run_config(path: str, config: Config, time_limit: float) -> float | None:
+    # 節の生成も含めた実行時間 (プロセスの起動時間はどの設定でも同じ)
+    # 制限時間内に正しい解が出なければNone
+    cmd = [executable, 'numberlink/main.py', '-t', path,
+           *config.args.split(), '--time-limit', str(time_limit), '--verify']
+    started = perf_counter()
+    try:
+        process = subprocess.run(cmd, capture_output=True,
+                                 timeout=10 * time_limit)
+    except subprocess.TimeoutExpired:
+        return None
+    elapsed = perf_counter() - started
+    output = process.stdout.decode('utf-8').splitlines()
+    if not output or output[-1] != 'VERIFIED' or elapsed > time_limit:
+        return None
+    return elapsed
+
+
+def leave_one_out(selector: Selector) -> list[int]:
+    # 各学習問題を除いた残りで選んだ設定の番号
+    choices: list[int] = []
+    for k, instance in enumerate(selector.instances):
+        others = Selector(
+            configs=selector.configs,
+            instances=selector.instances[:k] + selector.instances[k+1:],
+            timeout=selector.timeout,
+            neighbors=selector.neighbors,
+        )
+        choices.append(others.best(instance.features))
+    return choices
+
+
+def show_report(selector: Selector):
+    configs = selector.configs
+    instances = selector.instances
+    width = max(len(c.args) for c in configs)
+    totals = [sum(selector.penalized(i, c) for i in instances)
+              for c in range(len(configs))]
+    single = min(range(len(configs)), key=lambda c: totals[c])
+    best = [min(range(len(configs)), key=lambda c: selector.penalized(i, c))
+            for i in instances]
+
+    print(f'{"problem":<40} {"best":<{width}} {"leave-one-out":<{width}}')
+    loo = leave_one_out(selector) if len(instances) > 1 else best
+    for instance, b, c in zip(instances, best, loo):
+        # どの設定でも解けなかった問題には最良の設定がない
+        solved = instance.times[b] is not None
+        print(f'{instance.problem:<40} '
+              f'{configs[b].args if solved else "-":<{width}} '
+              f'{configs[c].args:<{width}}')
+
+    # 解けなかった実行を制限時間の2倍とした合計 (PAR-2)
+    loo_total = sum(selector.penalized(i, c) for i, c in zip(instances, loo))
+    vbs_total = sum(selector.penalized(i, b) for i, b in zip(instances, best))
+    print(f'single best ({configs[single].args}): {totals[single]:.3f}s')
+    print(f'selector (leave-one-out): {loo_total:.3f}s')
+    print(f'virtual best: {vbs_total:.3f}s')
+
+
+def main():
+    parser = ArgumentParser(
+        description='fit the encoding/solver selector used by main.py --auto')
+    parser.add_argument(
+        'problems',
+        nargs='*',
+        help='training problems (default: all ADC2014 problems)',
+    )
+    parser.add_argument(
+        '-o', '--output',
+        default='numberlink/selector.json',
+        help='selector file to write',
+    )
+    parser.add_argument(
+        '--windows',
+        type=int,
+        nargs='+',
+        # main.pyの-cと同じ範囲 (0は-cなし)
+        choices=[0, 2, 3, 4],
+        default=[0, 2, 3],
+        help='detour windows to try (0: no detour constraint; '
+        'since -c uses only the largest K, "-c 2 3" is the same as "-c 3")',
+    )
+    parser.add_argument(
+        '--solvers',
+        nargs='+',
+        default=['cadical153', 'glucose42', 'minisat22'],
+        help='SAT solvers to try',
+    )
+    parser.add_argument(
+        '--time-limit',
+        type=float,
+        default=60.0,
+        help='count runs slower than this as unsolved',
+    )
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=1,
+        help='runs per problem and configuration (the median is used)',
+    )
+    parser.add_argument(
+        '--neighbors',
+        type=int,
+        default=3,
+        help='number of nearest training problems the selector consults',
+    )
+    opts = parser.parse_args()
+
+    problems = opts.problems or sorted(glob('numberlink/ADC2014_QA/Q/*.txt'))
+    if not problems:
+        parser.error('no training problems')
+    configs = tuple(
+        Config(constraint=(w,) if w else (), solver=solver)
+        for w in opts.windows for solver in opts.solvers)
+
+    instances: list[Instance] = []
+    for path in problems:
+        times: list[float | None] = []
+        for config in configs:
+            samples = [run_config(path, config, opts.time_limit)
+                       for _ in range(opts.repeats)]
+            if any(t is None for t in samples):
+                elapsed = None
+            else:
+                elapsed = median(t for t in samples if t is not None)
+            times.append(elapsed)
+            status = 'TIMEOUT' if elapsed is None else f'{elapsed:.3f}'
+            print(f'{config.args} {path} {status}')
+        instances.append(Instance(
+            problem=path,
+            features=features(load_problem(path)),
+            times=tuple(times),
+        ))
+
+    selector = Selector(
+        configs=configs,
+        instances=tuple(instances),
+        timeout=opts.time_limit,
+        neighbors=opts.neighbors,
+    )
+    save_selector(selector, opts.output)
+    print(f'Saved {opts.output}')
+    show_report(selector)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TextIO
+
+from problem import Matrix, Numberlink
+
+
+@dataclass(frozen=True, kw_only=True)
+class Verification:
+    # 見つかった違反 (空なら正しい解)
+    errors: tuple[str, ...]
+    # 各マスが属する線の番号 (0-indexed, 線が通らないマスは-1)
+    labels: Matrix[int]
+
+    @property
+    def ok(self) -> bool:
+        return len(self.errors) == 0
+
+
+def find_answer_file(problem_filename: str) -> str | None:
+    # ADC2014_QA/Q/NL_Q01.txt -> ADC2014_QA/A/T99_A01.txt
+    p = Path(problem_filename)
+    if not p.name.startswith('NL_Q'):
+        return None
+    number = p.name.removeprefix('NL_Q')
+    answer = p.parent.parent / 'A' / f'T99_A{number}'
+    if not answer.exists():
+        return None
+    return str(answer)
+
+
+def load_answer(filename: str) -> Matrix[int]:
+    # SIZE 10X10
+    # 05,05,05,...
+    # 各マスの線の番号 (1-indexed, 00は空白) を0-indexedに直して返す
+    grid: Matrix[int] = []
+    with open(filename) as f:
+        for line in f.readlines():
+            line = line.strip()
+            if line == '' or line.startswith('SIZE'):
+                continue
+            grid.append([int(v) - 1 for v in line.split(',')])
+    return grid
+
+
+def write_answer(nl: Numberlink, labels: Matrix[int], out: TextIO):
+    # load_answerと逆の変換 (0-indexedの線の番号, -1は空白)
+    out.write(f'SIZE {nl.cols}X{nl.rows}\n')
+    for row in labels:
+        out.write(','.join(f'{v + 1:02d}' for v in row) + '\n')
+
+
+def verify_answer(
+        nl: Numberlink,
+        answer_s: Matrix[bool],
+        answer_e: Matrix[bool]) -> Verification:
+    # 各マスを高々定数回しか訪れないので、盤面の大きさに対して線形時間で終わる
+    errors: list[str] = []
+
+    def neighbors(i: int, j: int) -> list[tuple[int, int]]:
+        cells: list[tuple[int, int]] = []
+        if i != 0 and answer_s[i-1][j]:
+            cells.append((i-1, j))
+        if j != 0 and answer_e[i][j-1]:
+            cells.append((i, j-1))
+        if i != nl.rows-1 and answer_s[i][j]:
+            cells.append((i+1, j))
+        if j != nl.cols-1 and answer_e[i][j]:
+            cells.append((i, j+1))
+        return cells
+
+    # 1. 数字マスからは線が1本、空白マスからは0本か2本出る
+    #    (3本以上出ていれば、そのマスを複数の線が共有している)
+    degree = [[len(neighbors(i, j)) for j in range(nl.cols)]
+              for i in range(nl.rows)]
+    for i in range(nl.rows):
+        for j in range(nl.cols):
+            if nl.grid[i * nl.cols + j] == 0:
+                if degree[i][j] not in (0, 2):
+                    errors.append(
+                        f'blank cell ({j},{i}) has degree {degree[i][j]}')
+            elif degree[i][j] != 1:
+                errors.append(f'hint cell ({j},{i}) has degree {degree[i][j]}')
+
+    # 2. 各線の一方の端点からたどり、もう一方の端点に着くこと
+    labels: Matrix[int] = [[-1 for _ in range(nl.cols)]
+                           for _ in range(nl.rows)]
+    hint_at: dict[tuple[int, int], int] = {}
+    for h in nl.hints:
+        hint_at[(h.row, h.col)] = h.n
+    started: set[int] = set()
+    for h in nl.hints:
+        if h.n in started:
+            continue
+        started.add(h.n)
+        prev: tuple[int, int] | None = None
+        cur = (h.row, h.col)
+        while True:
+            if labels[cur[0]][cur[1]] != -1:
+                errors.append(
+                    f'line {h.n+1} crosses line '
+                    f'{labels[cur[0]][cur[1]]+1} at ({cur[1]},{cur[0]})')
+                break
+            labels[cur[0]][cur[1]] = h.n
+            nexts = [c for c in neighbors(*cur) if c != prev]
+            if cur != (h.row, h.col) and cur in hint_at:
+                if hint_at[cur] != h.n:
+                    errors.append(
+                        f'line {h.n+1} ends at hint {hint_at[cur]+1} '
+                        f'({cur[1]},{cur[0]})')
+                break
+            if len(nexts) != 1:
+                errors.append(
+                    f'line {h.n+1} is broken at ({cur[1]},{cur[0]})')
+                break
+            prev, cur = cur, nexts[0]
+
+    # 3. どの線にも属さないのに線が通っているマスは、孤立したループ
+    for i in range(nl.rows):
+        for j in range(nl.cols):
+            if labels[i][j] != -1 or degree[i][j] == 0:
+                continue
+            errors.append(f'stray loop at ({j},{i})')
+            # 同じループを重複して報告しないよう、ループ全体に印を付ける
+            stack = [(i, j)]
+            while stack:
+                r, c = stack.pop()
+                if labels[r][c] != -1:
+                    continue
+                labels[r][c] = -2
+                stack.extend(neighbors(r, c))
+    for row in labels:
+        for j, v in enumerate(row):
+            if v == -2:
+                row[j] = -1
+
+    return Verification(errors=tuple(errors), labels=labels)
+
+
+def count_differences(labels: Matrix[int], reference: Matrix[int]) -> int:
+    # 空白マスの埋め方は一意とは限らないので、正誤ではなく参考値として使う
+    return sum(
+        1
+        for row, ref_row in zip(labels, reference)
+        for v, ref in zip(row, ref_row)
+        if v != ref)
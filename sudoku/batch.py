@@ -0,0 +1,146 @@
+from typing import Iterable
+
+CELLS = 81
+DIGITS = 9
+BLANKS = '.0'
+
+
+def _units() -> list[list[int]]:
+    # 行, 列, ブロックの順に27個
+    rows = [[r * 9 + c for c in range(9)] for r in range(9)]
+    cols = [[r * 9 + c for r in range(9)] for c in range(9)]
+    blocks = [[(b // 3 * 3 + k // 3) * 9 + b % 3 * 3 + k % 3
+               for k in range(9)]
+              for b in range(9)]
+    return rows + cols + blocks
+
+
+UNITS = _units()
+PEERS = [sorted({q for u in UNITS if c in u for q in u} - {c})
+         for c in range(CELLS)]
+
+# 数字d (0-indexed) が入りうるマスを'1'に写す表
+_TABLES = [str.maketrans({ch: '1' if ch in BLANKS or ch == str(d + 1)
+                          else '0'
+                          for ch in BLANKS + '123456789'})
+           for d in range(DIGITS)]
+
+
+def parse_puzzles(lines: Iterable[str]) -> list[str]:
+    # 1行に1問、81文字 (空白マスは'.'か'0')
+    # 空行と'#'で始まる行は読み飛ばす
+    puzzles: list[str] = []
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if len(line) != CELLS or any(ch not in BLANKS + '123456789'
+                                     for ch in line):
+            raise ValueError(f'line {n}: expected 81 characters of 1-9, '
+                             f'"." or "0"')
+        puzzles.append(line)
+    return puzzles
+
+
+class Batch:
+    # N問の候補をまとめて持つ
+    # planes[c*9+d]のビットkは「k問目のマスcに数字dが入りうる」
+    # 多倍長整数のビット演算1回で、全ての問題を同時に処理する
+    def __init__(self, puzzles: list[str]) -> None:
+        self.size = len(puzzles)
+        self.all = (1 << self.size) - 1
+        self.planes: list[int] = []
+        for c in range(CELLS):
+            # k問目がビットkに来るよう、問題の順を逆にして2進数として読む
+            column = ''.join(p[c] for p in reversed(puzzles)) or '0'
+            for d in range(DIGITS):
+                self.planes.append(int(column.translate(_TABLES[d]), 2))
+        # 矛盾が見つかった (解のない) 問題
+        self.dead = 0
+        self.rounds = 0
+
+    def singles(self) -> list[int]:
+        # マスごとに、候補がちょうど1つの問題
+        result: list[int] = []
+        for c in range(CELLS):
+            one = two = 0
+            for plane in self.planes[c*9:c*9+9]:
+                two |= one & plane
+                one |= plane
+            result.append(one & ~two)
+        return result
+
+    def propagate(self):
+        # 単一候補 (naked single) と唯一候補 (hidden single) を
+        # 変化がなくなるまで繰り返す
+        planes = self.planes
+        while True:
+            before = list(planes)
+            self.rounds += 1
+
+            # 数字が決まったマスから、同じ行・列・ブロックの候補を消す
+            for c in range(CELLS):
+                one = two = 0
+                for plane in planes[c*9:c*9+9]:
+                    two |= one & plane
+                    one |= plane
+                self.dead |= self.all & ~one
+                single = one & ~two
+                if not single:
+                    continue
+                for d in range(DIGITS):
+                    fixed = planes[c*9+d] & single
+                    if fixed:
+                        for q in PEERS[c]:
+                            planes[q*9+d] &= ~fixed
+
+            # ある数字が入りうるマスが1つしかなければ、そのマスに決める
+            for unit in UNITS:
+                for d in range(DIGITS):
+                    one = two = 0
+                    for c in unit:
+                        plane = planes[c*9+d]
+                        two |= one & plane
+                        one |= plane
+                    self.dead |= self.all & ~one
+                    hidden = one & ~two
+                    if not hidden:
+                        continue
+                    for c in unit:
+                        fixed = planes[c*9+d] & hidden
+                        if fixed:
+                            for e in range(DIGITS):
+                                if e != d:
+                                    planes[c*9+e] &= ~fixed
+
+            if planes == before:
+                return
+
+    @property
+    def solved(self) -> int:
+        # 全てのマスの数字が決まり、矛盾のない問題
+        mask = self.all & ~self.dead
+        for single in self.singles():
+            mask &= single
+        return mask
+
+    def values(self) -> list[str]:
+        # 各問題の盤面を81文字で返す (決まっていないマスは'0')
+        # 各ビットを16進数の1桁に広げ、数字を掛けて足し合わせる
+        # 1マスに決まる数字は1つなので、桁上がりは起きない
+        if self.size == 0:
+            return []
+        columns: list[str] = []
+        for c, single in enumerate(self.singles()):
+            total = 0
+            for d in range(DIGITS):
+                fixed = self.planes[c*9+d] & single
+                if fixed:
+                    total += (d + 1) * int(format(fixed, 'b'), 16)
+            columns.append(format(total, f'0{self.size}x')[::-1])
+        return [''.join(cells) for cells in zip(*columns)]
+
+    def candidates(self, k: int) -> list[list[int]]:
+        # k問目の各マスに残っている数字 (0-indexed)
+        return [[d for d in range(DIGITS) if self.planes[c*9+d] >> k & 1]
+                for c in range(CELLS)]
@@ -1,8 +1,15 @@
 from argparse import ArgumentParser
+import json
+from operator import itemgetter
+import sys
 from dataclasses import dataclass
-from typing import cast
+from time import perf_counter
+from typing import TextIO, cast
 
-from cnf import CnfComposer, Literal
+from pysat.solvers import Solver
+
+from batch import Batch, parse_puzzles
+from cnf import EXIT_UNKNOWN, Budget, CnfComposer, Literal, enumerate_models
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -39,23 +46,22 @@ def load_problem(filename: str) -> Sudoku:
         return Sudoku(rows=rows, cols=cols, hints=tuple(hints))
 
 
-def display(grid: list[list[int]]):
-    s = '┏━━━┯━━━┯━━━┳━━━┯━━━┯━━━┳━━━┯━━━┯━━━┓\n'
+def display(grid: list[list[int]], out: TextIO = sys.stdout):
+    # 1行ずつ組み立てて書き出す
+    lines = ['┏━━━┯━━━┯━━━┳━━━┯━━━┯━━━┳━━━┯━━━┯━━━┓']
     for r in range(9):
-        s += '┃'
+        line = ['┃']
         for c in range(9):
-            if grid[r][c] == -1:
-                s += '   '
-            else:
-                s += f' {grid[r][c]+1} '
-            s += '┃' if c % 3 == 2 else '│'
+            line.append('   ' if grid[r][c] == -1 else f' {grid[r][c]+1} ')
+            line.append('┃' if c % 3 == 2 else '│')
+        lines.append(''.join(line))
         if r == 8:
-            s += '\n┗━━━┷━━━┷━━━┻━━━┷━━━┷━━━┻━━━┷━━━┷━━━┛'
+            lines.append('┗━━━┷━━━┷━━━┻━━━┷━━━┷━━━┻━━━┷━━━┷━━━┛')
         elif r % 3 == 2:
-            s += '\n┣━━━┿━━━┿━━━╋━━━┿━━━┿━━━╋━━━┿━━━┿━━━┫\n'
+            lines.append('┣━━━┿━━━┿━━━╋━━━┿━━━┿━━━╋━━━┿━━━┿━━━┫')
         else:
-            s += '\n┠───┼───┼───╂───┼───┼───╂───┼───┼───┨\n'
-    print(s)
+            lines.append('┠───┼───┼───╂───┼───┼───╂───┼───┼───┨')
+    out.write('\n'.join(lines) + '\n')
 
 
 parser = ArgumentParser(
@@ -64,19 +70,146 @@ parser = ArgumentParser(
 )
 parser.add_argument(
     'filename',
-    help='problem file',
+    help='problem file (with --batch: one 81-character puzzle per line)',
+)
+parser.add_argument(
+    '--batch',
+    action='store_true',
+    help='solve every puzzle in the file, eliminating candidates for all of '
+    'them at once and passing only the leftovers to the SAT solver',
+)
+parser.add_argument(
+    '--batch-size',
+    type=int,
+    metavar='N',
+    help='with --batch, eliminate candidates N puzzles at a time '
+    '(default: the whole file)',
 )
 parser.add_argument(
     '-o', '--output',
     help='output dimacs file',
 )
+parser.add_argument(
+    '--format',
+    choices=['box', 'json'],
+    default='box',
+    help='solution output format (json: one line per solution, '
+    'plus a summary line with --count/--unique, without drawing the board)',
+)
+parser.add_argument(
+    '--simplify',
+    action='store_true',
+    help='simplify the CNF before solving (unit propagation, subsumption, '
+    'variable elimination)',
+)
+parser.add_argument(
+    '--count',
+    type=int,
+    metavar='N',
+    help='enumerate up to N solutions (0 for all)',
+)
+parser.add_argument(
+    '--unique',
+    action='store_true',
+    help='check whether the solution is unique',
+)
+parser.add_argument(
+    '--solver',
+    default='cadical153',
+    help='SAT solver name (e.g. cadical153, glucose42, minisat22)',
+)
+parser.add_argument(
+    '--time-limit',
+    type=float,
+    metavar='SECONDS',
+    help='give up and report UNKNOWN after SECONDS',
+)
+parser.add_argument(
+    '--conflict-limit',
+    type=int,
+    metavar='N',
+    help='give up and report UNKNOWN after N conflicts',
+)
+parser.add_argument(
+    '--propagation-limit',
+    type=int,
+    metavar='N',
+    help='give up and report UNKNOWN after N propagations '
+    '(not supported by cadical)',
+)
 opts = parser.parse_args()
 
 
-def main():
-    sudoku = load_problem(opts.filename)
-    cc = CnfComposer()
+def show_statistics(solver: Solver):
+    # 予算切れで打ち切った場合も、そこまでの統計を出す
+    stats = solver.accum_stats() or {}
+    items = [f'{k}={v}' for k, v in stats.items()]
+    items.append(f'time={solver.time_accum():.6f}')
+    print('Statistics: ' + ', '.join(items))
+
+
+def decode_solution(
+        model: list[int],
+        p: list[list[list[Literal]]]) -> list[list[int]]:
+    # pの値をitemgetterでまとめて取り出してから、マスごとに真の数字を探す
+    ids = [l.id - 1 for row in p for cell in row for l in cell]
+    values = itemgetter(*ids)(model)
+    grid = [[-1 for _ in range(9)] for _ in range(9)]
+    for c in range(81):
+        cell = values[9*c:9*c+9]
+        grid[c // 9][c % 9] = next(
+            (k for k, v in enumerate(cell) if v > 0), -1)
+    return grid
+
+
+def show_solution(grid: list[list[int]], index: int | None = None):
+    if opts.format == 'box':
+        display(grid)
+        return
+    # 数字は1-indexed, 空白は0
+    # --batchのときは、ファイル中の何問目か(1-indexed)も出す
+    record: dict[str, object] = {'problem': opts.filename}
+    if index is not None:
+        record['index'] = index
+    record['status'] = 'SAT'
+    record['grid'] = [[v + 1 for v in row] for row in grid]
+    print(json.dumps(record))
+
+
+def show_status(status: str, index: int | None = None):
+    if opts.format == 'json':
+        record: dict[str, object] = {'problem': opts.filename}
+        if index is not None:
+            record['index'] = index
+        record['status'] = status
+        print(json.dumps(record))
+    elif status == 'UNSAT':
+        print("No solution")
+    else:
+        print(status)
+
+
+def show_count_summary(
+        num_solutions: int,
+        limit: int | None,
+        elapsed: float,
+        exhausted: bool):
+    # --formatがjsonのときの、解を数え終えた後の1行
+    # completeは全ての解を数えきったかどうか
+    record: dict[str, object] = {'problem': opts.filename}
+    if exhausted:
+        # 見つかった解の数は下限でしかない
+        record['status'] = 'UNKNOWN'
+    elif opts.unique:
+        record['status'] = ['UNSAT', 'UNIQUE', 'NOT UNIQUE'][num_solutions]
+    record['solutions'] = num_solutions
+    record['complete'] = not exhausted \
+        and (limit is None or num_solutions < limit)
+    record['elapsed'] = elapsed
+    print(json.dumps(record))
 
+
+def add_rules(cc: CnfComposer) -> list[list[list[Literal]]]:
     # p[i][j][k] := マス(i, j)に数字kが入る
     p: list[list[list[Literal]]] = []
 
@@ -156,6 +289,109 @@ def main():
                 for n in range(9):
                     cc.add_clause([-p[i][j][n], -p[i][col][n]])
 
+    return p
+
+
+def make_budget() -> Budget:
+    return Budget(
+        time_limit=opts.time_limit,
+        conflict_limit=opts.conflict_limit,
+        propagation_limit=opts.propagation_limit,
+    )
+
+
+def solve_batch():
+    # 候補の消去は全ての問題でまとめて行い、
+    # それだけで解けなかった問題を1つのソルバで順に解く
+    # 問題ごとの違いは、決まったマスと消えた候補を仮定として与えるだけ
+    if opts.count is not None or opts.unique:
+        parser.error('--batch cannot be combined with --count/--unique')
+    if opts.output is not None or opts.simplify:
+        parser.error('--batch cannot be combined with -o or --simplify')
+    try:
+        with open(opts.filename) as f:
+            puzzles = parse_puzzles(f)
+    except ValueError as err:
+        parser.error(f'{opts.filename}: {err}')
+    if opts.batch_size is not None and opts.batch_size < 1:
+        parser.error('--batch-size must be positive')
+    batch_size = opts.batch_size or max(len(puzzles), 1)
+
+    cc = CnfComposer()
+    p = add_rules(cc)
+    solver = cc.to_solver(opts.solver)
+    presolve_elapsed = 0.0
+    by_propagation = by_sat = unsolvable = unknown = 0
+    try:
+        for start in range(0, len(puzzles), batch_size):
+            started = perf_counter()
+            batch = Batch(puzzles[start:start+batch_size])
+            batch.propagate()
+            solved = batch.solved
+            values = batch.values()
+            presolve_elapsed += perf_counter() - started
+
+            for k, value in enumerate(values):
+                index = start + k + 1
+                if opts.format == 'box':
+                    print(f"Puzzle #{index}:")
+                if batch.dead >> k & 1:
+                    unsolvable += 1
+                    show_status('UNSAT', index)
+                    continue
+                if solved >> k & 1:
+                    by_propagation += 1
+                    show_solution([[int(v) - 1 for v in value[r*9:r*9+9]]
+                                   for r in range(9)], index)
+                    continue
+
+                assumptions: list[int] = []
+                for c, digits in enumerate(batch.candidates(k)):
+                    cell = p[c // 9][c % 9]
+                    if len(digits) == 1:
+                        assumptions.append(cell[digits[0]].id)
+                    else:
+                        assumptions.extend(-cell[d].id for d in range(9)
+                                           if d not in digits)
+                try:
+                    is_satisfiable = make_budget().solve(solver, assumptions)
+                except NotImplementedError as err:
+                    parser.error(f"{opts.solver}: {err}")
+                if is_satisfiable is None:
+                    unknown += 1
+                    show_status('UNKNOWN', index)
+                elif not is_satisfiable:
+                    unsolvable += 1
+                    show_status('UNSAT', index)
+                else:
+                    by_sat += 1
+                    model = cast(list[int], solver.get_model())
+                    show_solution(decode_solution(model, p), index)
+        sat_elapsed = solver.time_accum()
+    finally:
+        solver.delete()
+
+    if opts.format == 'box':
+        rate = len(puzzles) / presolve_elapsed \
+            if presolve_elapsed > 0 else float('inf')
+        print(f"Batch: {len(puzzles)} puzzles (batch size {batch_size}), "
+              f"{by_propagation} by propagation, {by_sat} by SAT, "
+              f"{unsolvable} unsolvable, {unknown} unknown")
+        print(f"Presolve: {presolve_elapsed:.6f}s ({rate:.1f} puzzles/s), "
+              f"SAT: {sat_elapsed:.6f}s")
+    if unknown:
+        sys.exit(EXIT_UNKNOWN)
+
+
+def main():
+    if opts.batch:
+        solve_batch()
+        return
+    sudoku = load_problem(opts.filename)
+    cc = CnfComposer()
+
+    p = add_rules(cc)
+
     for hint in sudoku.hints:
         cc.add_clause([p[hint.row][hint.col][hint.value]])
 
@@ -163,28 +399,100 @@ def main():
         with open(opts.output, 'w') as f:
             f.write(cc.to_dimacs())
 
-    print("Problem:")
-    grid = [[-1 for _ in range(9)] for _ in range(9)]
-    for hint in sudoku.hints:
-        grid[hint.row][hint.col] = hint.value
-    display(grid)
+    if opts.format == 'box':
+        print("Problem:")
+        grid = [[-1 for _ in range(9)] for _ in range(9)]
+        for hint in sudoku.hints:
+            grid[hint.row][hint.col] = hint.value
+        display(grid)
 
-    solver = cc.to_solver()
-    is_satisfiable = solver.solve()
-    if not is_satisfiable:
-        print("No solution")
+    if opts.simplify:
+        # 解を数えるときは、ブロッキング節に使うpを消去しない
+        frozen: list[Literal] = []
+        if opts.count is not None or opts.unique:
+            frozen = [l for row in p for cell in row for l in cell]
+        simp = cc.simplify(frozen=frozen)
+        if opts.format == 'box':
+            print(f"Simplify: {simp.num_clauses_before} -> "
+                  f"{simp.num_clauses} clauses, "
+                  f"{simp.num_literals_before} -> {simp.num_literals} "
+                  f"literals, {len(simp.fixed)} fixed, "
+                  f"{len(simp.eliminated)} eliminated "
+                  f"({simp.elapsed:.3f}s)")
+
+    solver = cc.to_solver(opts.solver)
+    budget = make_budget()
+    if opts.count is not None or opts.unique:
+        # --uniqueは2つ目の解が見つかった時点で打ち切る
+        if opts.unique:
+            limit = 2
+        elif opts.count:
+            limit = opts.count
+        else:
+            limit = None
+
+        # pだけで解を区別する
+        projection = [l for row in p for cell in row for l in cell]
+        num_solutions = 0
+        models = enumerate_models(
+            solver, projection, limit=limit, budget=budget)
+        try:
+            for model in models:
+                num_solutions += 1
+                if opts.format == 'box':
+                    print(f"Solution #{num_solutions}:")
+                show_solution(decode_solution(cc.extend_model(model), p))
+        except NotImplementedError as err:
+            parser.error(f"{opts.solver}: {err}")
+
+        elapsed = solver.time_accum()
+        if opts.format == 'json':
+            # 解と同じく1行のJSONにして、出力全体を1行1つのJSONのまま保つ
+            show_count_summary(num_solutions, limit, elapsed,
+                               budget.exhausted)
+            if budget.exhausted:
+                sys.exit(EXIT_UNKNOWN)
+            return
+        rate = num_solutions / elapsed if elapsed > 0 else float('inf')
+        if budget.exhausted:
+            status = " (budget exhausted)"
+        elif limit is None or num_solutions < limit:
+            status = " (all)"
+        else:
+            status = " (limit reached)"
+        print(f"Solutions: {num_solutions}" + status)
+        print(f"Elapsed: {elapsed:.6f}s ({rate:.1f} solutions/s)")
+        if budget.exhausted:
+            # 見つかった解の数は下限でしかない
+            print("UNKNOWN")
+            show_statistics(solver)
+            sys.exit(EXIT_UNKNOWN)
+        if opts.unique:
+            if num_solutions == 0:
+                print("No solution")
+            elif num_solutions == 1:
+                print("UNIQUE")
+            else:
+                print("NOT UNIQUE")
         return
 
-    model = cast(list[int], solver.get_model())
-    for i in range(9):
-        for j in range(9):
-            for k in range(9):
-                if model[p[i][j][k].id-1] > 0:
-                    grid[i][j] = k
-                    break
+    try:
+        is_satisfiable = budget.solve(solver)
+    except NotImplementedError as err:
+        parser.error(f"{opts.solver}: {err}")
+    if is_satisfiable is None:
+        show_status('UNKNOWN')
+        if opts.format == 'box':
+            show_statistics(solver)
+        sys.exit(EXIT_UNKNOWN)
+    if not is_satisfiable:
+        show_status('UNSAT')
+        return
 
-    print("Solution:")
-    display(grid)
+    model = cc.extend_model(cast(list[int], solver.get_model()))
+    if opts.format == 'box':
+        print("Solution:")
+    show_solution(decode_solution(model, p))
 
 
 if __name__ == '__main__':